@@ -0,0 +1,51 @@
+import math
+
+
+CONST_TOLERANCE = 0.02
+# Intervals ignored before tracking starts: TCP slow start and Wi-Fi rate adaptation settle in the first seconds
+CONST_WARMUP = 5
+CONST_MIN_SAMPLES = 10
+# Two-sided 95% normal quantile
+CONST_Z = 1.96
+
+
+class ConvergenceDetector:
+    # Running mean and variance (Welford) of one direction's interval Mbps after the warm-up. Converged once the
+    # confidence interval of the mean is within +-tolerance of the mean itself; sticky from then on.
+    def __init__(self, tolerance=CONST_TOLERANCE, warmup=CONST_WARMUP, min_samples=CONST_MIN_SAMPLES, z=CONST_Z):
+        if tolerance <= 0:
+            raise ValueError("tolerance must be positive")
+        self.tolerance = tolerance
+        self.warmup = warmup
+        self.min_samples = max(min_samples, 2)
+        self.z = z
+        self.count = 0
+        self.converged_at = None
+        self._samples = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    @property
+    def converged(self):
+        return self.converged_at is not None
+
+    @property
+    def mean(self):
+        return self._mean if self._samples else None
+
+    def half_width(self):
+        if self._samples < 2:
+            return None
+        return self.z * math.sqrt(self._m2 / (self._samples - 1) / self._samples)
+
+    def add(self, value):
+        self.count += 1
+        if self.converged or self.count <= self.warmup:
+            return self.converged
+        self._samples += 1
+        delta = value - self._mean
+        self._mean += delta / self._samples
+        self._m2 += delta * (value - self._mean)
+        if self._samples >= self.min_samples and self.half_width() <= self.tolerance * abs(self._mean):
+            self.converged_at = self.count
+        return self.converged
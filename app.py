@@ -1,42 +1,110 @@
-import json
-import subprocess
+import importlib
 import time
-from time import sleep
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
 from tkinter.filedialog import asksaveasfilename
-import openpyxl
-from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib.figure import Figure
-from openpyxl.chart import Reference, LineChart
 import threading
-from PIL import Image, ImageTk
+from campaign import Campaign, load_plan
+import export
+from engine import BandwidthEngine, CONST_DEFAULT_SERVER, CONST_DEFAULT_PORT
+from fanout import FanOut, parse_targets
+import instrumentation
+import samples
+import scheduler
+import stats
+from store import ResultStore, CONST_DEFAULT_DB
+from tuning import StreamTuner, TuningCache
+from ui_events import UIEventQueue
+
+
+CONST_HISTORY_LIMIT = 200
+CONST_POWER_WIFI_PLAN = 'plans/power_wifi.json'
+CONST_LOADING_GIF = 'loading.gif'
+CONST_FRAME_MS = 100
+# What the first test, plot and export need (matplotlib, numpy, openpyxl, PIL). None of it is imported to open
+# the window; a background thread pulls it in once the window is up, so first use rarely waits on an import.
+CONST_PREWARM = ('live_plot', 'numpy', 'openpyxl.chart', 'PIL.ImageTk', 'async_engine')
+
+_decoded_gifs = {}
+_decode_lock = threading.Lock()
+_prewarm_started = threading.Event()
+
+
+def decode_gif(path):
+    # Decoded once per process and shared by every window
+    with _decode_lock:
+        if path not in _decoded_gifs:
+            from PIL import Image
+            frames = []
+            with Image.open(path) as gif:
+                for index in range(getattr(gif, 'n_frames', 1)):
+                    gif.seek(index)
+                    frames.append(gif.convert('RGBA'))
+            _decoded_gifs[path] = frames
+        return _decoded_gifs[path]
 
 
-CONST_ACCEPTED_RSSI = -50
+def prewarm():
+    with instrumentation.span('prewarm'):
+        for module in CONST_PREWARM:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                # Reported where the module is actually used
+                pass
+        decode_gif(CONST_LOADING_GIF)
 
 
 class BandwidthTest(tk.Tk):
-    def __init__(self, server='89.187.160.1', port=5201, duration=10, iterations=1, stream=10):
+    def __init__(self, server=CONST_DEFAULT_SERVER, port=CONST_DEFAULT_PORT, duration=10, iterations=1, stream=10,
+                 mode='sequential', order=scheduler.CONST_DIRECTIONS):
         super().__init__()
-        self.upl = []
-        self.dowl = []
-        self.error_cnt = 0
-        self.server = server
-        self.port = port
-        self.duration = duration
-        self.iterations = iterations
-        self.stream = stream
-        self.test_results = []
+        # Workers only post here; the Tk loop drains it and does all widget work
+        self.events = UIEventQueue(self)
+        self.events.register('result', self.on_live_results, coalesce=True)
+        self.events.register('error', self.show_test_error)
+        self.store = ResultStore(CONST_DEFAULT_DB)
+        self.engine = BandwidthEngine(server=server, port=port, duration=duration, iterations=iterations,
+                                      stream=stream, mode=mode, order=order, store=self.store,
+                                      on_result=lambda result: self.events.post('result', result),
+                                      on_error=lambda error: self.events.post('error', error))
+        self.live_upl = []
+        self.live_dowl = []
+        self._test_running = False
+        self.live_plot = None
+        self.result_text = None
+        self.fanout = None
+        # Started on the first multi-server test; every fan-out shares its one event loop thread
+        self.bridge = None
+        self.tuner = None
+        self.campaign = None
+        self._operator_confirmed = None
+        self.servers = ''
         self.ServerChosen = None
+        self.ServerListChosen = None
         self.DurationChosen = None
         self.StreamChosen = None
         self.PortChosen = None
+        self.ModeChosen = None
+        self.OrderChosen = None
         self.main_frame = None
+        self._is_loading = False
+        # Tk images belong to one interpreter, so each window converts the shared decoded frames once
+        self._loading_frames = None
+        self._animation = None
         self.title("Bandwidth Test")
         self.geometry("800x600")
         self.create_widget()
+        self.events.start()
+        self.after_idle(self.start_prewarm)
+
+    @staticmethod
+    def start_prewarm():
+        # Once per process: a window opened with New Window finds everything already loaded
+        if not _prewarm_started.is_set():
+            _prewarm_started.set()
+            threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
 
     def create_widget(self):
         menubar = tk.Menu(self)
@@ -45,56 +113,38 @@ class BandwidthTest(tk.Tk):
         menubar.add_cascade(label='Option', menu=option)
         option.add_command(label="New Window", command=self.new_window)
         option.add_command(label="BW Test", command=self.bandwidth_test)
+        option.add_command(label="Multi Server Test", command=self.multi_server_test)
         option.add_command(label="Export as Excel", command=self.export_bandwidth_test_to_excel)
+        option.add_command(label="History", command=self.show_history)
+        option.add_command(label="Export History", command=self.export_history)
         option.add_command(label="Configure Server", command=self.configure_setting)
         option.add_command(label="Power Wifi Test", command=self.testing_power_wifi)
         option.add_separator()
-        option.add_command(label="Exit", command=self.destroy)
+        option.add_command(label="Exit", command=self.on_close)
 
         self.config(menu=menubar)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.main_frame = ttk.Frame(self)
         self.main_frame.config()
         self.main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-    @staticmethod
-    def _get_frames(img):
-        with Image.open(img) as gif:
-            index = 0
-            frames = []
-            while True:
-                try:
-                    gif.seek(index)
-                    frame = ImageTk.PhotoImage(gif)
-                    frames.append(frame)
-                except EOFError:
-                    break
-
-                index += 1
-            return frames
-
-    def _play_gif(self, label, frames):
-        total_delay = 50
-        delay_frame = 100
-        for frame in frames:
-            if not self._is_loading:
-                return
-            self.after(total_delay, self._next_frame, frame, label, frames)
-            total_delay += delay_frame
-        self.after(total_delay, self._next_frame, frame, label, frames, True)
+    def _get_frames(self):
+        if self._loading_frames is None:
+            from PIL import ImageTk
+            self._loading_frames = [ImageTk.PhotoImage(frame, master=self) for frame in decode_gif(CONST_LOADING_GIF)]
+        return self._loading_frames
 
-    def _next_frame(self, frame, label, frames, restart=False):
-        if restart:
-            try:
-                label.config()
-            except tk.TclError:
-                return
-            self.after(1, self._play_gif, label, frames)
+    def _play_gif(self, label, frames, index=0):
+        # One pending timer for the whole animation: each tick shows a frame and schedules the next
+        self._animation = None
+        if not self._is_loading:
             return
         try:
-            label.config(image=frame)
+            label.config(image=frames[index])
         except tk.TclError:
             return
+        self._animation = self.after(CONST_FRAME_MS, self._play_gif, label, frames, (index + 1) % len(frames))
 
     def loading(self):
         for child in self.main_frame.winfo_children():
@@ -107,209 +157,198 @@ class BandwidthTest(tk.Tk):
         )
         self._is_loading = True
         loading_label.pack()
-        frames = self._get_frames('loading.gif')
-        self._play_gif(loading_label, frames)
-        return
+        stop_button = tk.Button(self.main_frame, text='Stop', command=self.stop_test)
+        stop_button.pack(pady=10)
+        if self._animation is not None:
+            self.after_cancel(self._animation)
+        self._play_gif(loading_label, self._get_frames())
 
     def stop_loading(self):
         self._is_loading = False
 
+    def stop_test(self):
+        self.engine.cancel()
+        if self.fanout is not None:
+            self.fanout.cancel()
+        if self.campaign is not None:
+            self.campaign.cancel()
+        if self.tuner is not None:
+            self.tuner.cancel()
+        # Release a campaign thread that is waiting on an operator prompt
+        if self._operator_confirmed is not None:
+            self._operator_confirmed.set()
+
+    def on_close(self):
+        # Don't leave iperf3/ping children running once the window is gone
+        self.stop_test()
+        self.events.stop()
+        if self.bridge is not None:
+            self.bridge.close()
+        self.destroy()
+
+    def show_stopped_test(self):
+        self.stop_loading()
+        self.display_graph_plot(upl=self.engine.upl, dowl=self.engine.dowl)
+
     @staticmethod
     def new_window():
         new = BandwidthTest()
         new.mainloop()
 
-    def run_iperf3_test(self, reverse, stop_event):
-        if stop_event.is_set():
-            return
-
-        command = [
-            'iperf3',
-            '-c', self.server,
-            '-p', str(self.port),
-            '-t', str(self.duration),
-            '-P', str(self.stream),
-            '-J',  # JSON output
-        ]
+    def show_test_error(self, error):
+        messagebox.showerror(title='test state', message=f"error: {error}", parent=self)
 
-        if reverse:
-            command.append('-R')
-
-        try:
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            stdout, stderr = process.communicate()
-            while not stop_event.is_set() and process.poll() is None:
-                sleep(10)
+    def on_live_results(self, results):
+        new_upl = []
+        new_dowl = []
+        for result in results:
+            if 'sent_Mbps' in result:
+                new_upl.append(result['sent_Mbps'])
+            elif 'received_Mbps' in result:
+                new_dowl.append(result['received_Mbps'])
 
-            if stop_event.is_set():
-                process.terminate()
-                return
+        self.live_upl.extend(new_upl)
+        self.live_dowl.extend(new_dowl)
+        if (new_upl or new_dowl) and self._test_running:
+            self.update_live_dashboard(new_upl, new_dowl)
 
-            result_data = json.loads(stdout)
-
-            if 'error' in result_data:
-                self.test_results.append({'error': result_data['error']})
-                messagebox.showerror(title='test state', message=f"error: {result_data['error']}", parent=self)
-            else:
-                for interval in result_data['intervals']:
-                    if reverse:
-                        self.test_results.append({
-                            'received_Mbps': interval['sum']['bits_per_second'] / 1e6,
-                        })
-                    else:
-                        self.test_results.append({
-                            'sent_Mbps': interval['sum']['bits_per_second'] / 1e6,
-                        })
-        except subprocess.CalledProcessError as e:
-            self.test_results.append({'error': str(e)})
-        except json.JSONDecodeError:
-            self.test_results.append({'error': 'Failed to parse JSON output from iperf3'})
-
-    def check_server_status(self, stop_event):
-        command = [
-            'ping',
-            '-c', '1',  # Send only 1 packet
-            self.server,
-        ]
-
-        while not stop_event.is_set():
-            try:
-                start_time = time.time()
-                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                stdout, stderr = process.communicate()
-                while (time.time() - start_time) < 3:
-                    if process.poll() is None:
-                        sleep(1)
-
-                if ((time.time() - start_time) >= 3) and process.poll() is None:
-                    process.terminate()
-                    stop_event.set()
-                    return
-
-                # Check if 'bytes from' is in the output to determine success
-                if 'bytes from' in stdout:
-                    sleep(10)
-                else:
-                    print("Server did not respond to ping")
-                    stop_event.set()
-                    return
-            except subprocess.CalledProcessError as e:
-                print(f"Server check error: {str(e)}")
-                stop_event.set()
-                return
+    def start_live_results(self):
+        self.live_upl = []
+        self.live_dowl = []
+        self._test_running = True
+        self.live_plot = None
 
     def run_multiple_tests(self):
-        def test_wrapper():
-            self.clear_test_results()
-
-            stop_event = threading.Event()
-            thread1 = threading.Thread(target=self.run_iperf3_test, args=(False, stop_event))
-            thread2 = threading.Thread(target=self.run_iperf3_test, args=(True, stop_event))
-            thread3 = threading.Thread(target=self.check_server_status, args=(stop_event,))
-
-            thread1.start()
-            thread3.start()
-
-            thread1.join()
-            sleep(1)
-            thread2.start()
-            thread2.join()
-
-            stop_event.set()
-
-            self.process_test_results()
+        def finish_test():
+            self._test_running = False
+            if self.engine.cancelled:
+                self.show_stopped_test()
+                return
 
-            if self.is_test_bandwidth_fail():
-                messagebox.showerror(title="Test State", message="Test failed", parent=self)
-                self.display_graph_plot(upl=self.upl, dowl=self.dowl)
+            # The same verdict the store records: no data, a failed rule or a server that stopped answering
+            summary = self.engine.summary()
+            if not summary['passed']:
+                message = "Test failed: the server stopped answering" if summary['server_down'] else "Test failed"
+                messagebox.showerror(title="Test State", message=message, parent=self)
+                self.display_graph_plot(upl=self.engine.upl, dowl=self.engine.dowl)
                 self.stop_loading()
                 return
 
             messagebox.showinfo(title="Test State", message="Test successfully completed", parent=self)
             self.stop_loading()
-            self.display_graph_plot(upl=self.upl, dowl=self.dowl)
+            self.display_graph_plot(upl=self.engine.upl, dowl=self.engine.dowl)
+
+        def test_wrapper():
+            self.engine.band = None
+            self.engine.rssi = None
+            self.engine.run_tests()
+            self.events.call(finish_test)
 
         threading.Thread(target=test_wrapper).start()
         self.loading()
+        self.start_live_results()
 
     def export_bandwidth_test_to_excel(self):
-        wb = openpyxl.Workbook()
-        sheet = wb.active
-        sheet.title = "Bandwidth Test Result"
-        sheet['A1'].value = "Upload (Mbps)"
-        sheet['B1'].value = "Download (Mbps)"
-        row = 2
-        for data in self.upl:
-            sheet[f'A{row}'].value = data
-            row += 1
-
-        row = 2
-        for data in self.dowl:
-            sheet[f'B{row}'].value = data
-            row += 1
-
-        average_upl, average_dowl = self.average_bandwidth(upl=self.upl, dowl=self.dowl)
-        sheet['D5'].value = "Average Upload: "
-        sheet['D6'].value = "Average Download: "
-
-        sheet['E5'].value = "{:.2f}".format(average_upl)
-        sheet['E6'].value = "{:.2f}".format(average_dowl)
-
-        # Create upload chart
-        upload_chart = LineChart()
-        upload_chart.title = "Upload Chart"
-        upload_chart.x_axis.title = "Times"
-        upload_chart.y_axis.title = "Mbps"
-        upload_values = Reference(sheet, min_col=1, max_col=1, min_row=1, max_row=len(self.upl) + 1)
-        upload_chart.add_data(upload_values, titles_from_data=True)
-        sheet.add_chart(upload_chart, "G2")
-
-        # Create download chart
-        download_chart = LineChart()
-        download_chart.title = "Download Chart"
-        download_chart.x_axis.title = "Times"
-        download_chart.y_axis.title = "Mbps"
-        download_values = Reference(sheet, min_col=2, max_col=2, min_row=1, max_row=len(self.dowl) + 1)
-        download_chart.add_data(download_values, titles_from_data=True)
-        sheet.add_chart(download_chart, "G20")
-
         files = [('Excel Files', '*.xlsx')]
         save_path = asksaveasfilename(filetypes=files)
         if save_path:
-            wb.save(save_path)
+            average_upl, average_dowl = self.engine.average_bandwidth(upl=self.engine.upl, dowl=self.engine.dowl)
+            with instrumentation.span('export', format='xlsx'):
+                export.export_run_xlsx(save_path, self.engine.upl, self.engine.dowl, average_upl, average_dowl)
             messagebox.showinfo(title="Export state", message="Export Completed", parent=self)
 
+    def export_history(self):
+        files = [('Excel Files', '*.xlsx'), ('CSV Files', '*.csv'), ('Parquet Files', '*.parquet')]
+        save_path = asksaveasfilename(filetypes=files, defaultextension='.xlsx')
+        if not save_path:
+            return
+        run_ids = [run['run_id'] for run in self.store.query_runs()]
+        try:
+            with instrumentation.span('export', format=save_path.rsplit('.', 1)[-1]):
+                export.export_runs(self.store, run_ids, save_path)
+        except (ValueError, RuntimeError) as e:
+            messagebox.showerror(title="Export state", message=str(e), parent=self)
+            return
+        messagebox.showinfo(title="Export state", message=f"Exported {len(run_ids)} runs", parent=self)
+
+    def show_dashboard(self):
+        from live_plot import LivePlot
+        self.clear_main_frame()
+        self.live_plot = LivePlot(self.main_frame)
+        self.result_text = tk.Text(self.main_frame, height=10, width=50)
+        self.result_text.pack(fill=tk.BOTH, expand=1)
+
+    def dashboard_alive(self):
+        return self.live_plot is not None and self.live_plot.canvas.get_tk_widget().winfo_exists()
+
+    def update_live_dashboard(self, new_upl, new_dowl):
+        if not self.dashboard_alive():
+            self.show_dashboard()
+            stop_button = tk.Button(self.main_frame, text='Stop', command=self.stop_test)
+            stop_button.pack(pady=10)
+            new_upl, new_dowl = self.live_upl, self.live_dowl
+        self.live_plot.append(new_upl, new_dowl)
+
+        # One direction may not have started yet, so average each list on its own
+        upl, dowl = self.live_upl, self.live_dowl
+        average_upl = "{:.2f}".format(sum(upl) / len(upl)) if upl else '-'
+        average_dowl = "{:.2f}".format(sum(dowl) / len(dowl)) if dowl else '-'
+        self.result_text.delete('1.0', tk.END)
+        self.result_text.insert(tk.END, f"Running...\n"
+                                        f"Upload: {average_upl} Mbps ({len(upl)} intervals)\n"
+                                        f"Download: {average_dowl} Mbps ({len(dowl)} intervals)\n"
+                                        f"Server: {self.engine.server}\n"
+                                        f"Port: {self.engine.port}\n")
+
+    def elapsed_series(self, values, direction):
+        # Seconds since the run started for each interval, the axis the RTT probes are plotted on too
+        started_at = self.engine.started_at
+        if started_at is not None:
+            times = [timestamp - started_at for timestamp, _, _ in self.engine.samples.rows(direction)]
+            if len(times) == len(values):
+                return times, values
+        return range(1, len(values) + 1), values
+
     def display_graph_plot(self, upl, dowl):
-        for widget in self.main_frame.winfo_children():
-            widget.destroy()
-        fig = Figure(figsize=(5, 5), dpi=80)
-        plot1 = fig.add_subplot(111)
-
-        plot1.plot(upl, label='Upload')
-        plot1.plot(dowl, label='Download')
-        plot1.legend()
-
-        canvas = FigureCanvasTkAgg(fig, master=self.main_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
-        plot1.set_xlabel('time (t)')
-        plot1.set_ylabel('Speed (Mbps)')
-        toolbar = NavigationToolbar2Tk(canvas, self.main_frame)
-        toolbar.update()
-        canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
-
-        result_text = tk.Text(self.main_frame, height=10, width=50)
-        result_text.pack(fill=tk.BOTH, expand=1)
-        average_upl, average_dowl = self.average_bandwidth(upl=upl, dowl=dowl)
-        if average_upl == 'error' and average_dowl == 'error':
+        # Reuse the live figure when there is one; only the final series and summary change
+        if not self.dashboard_alive():
+            self.show_dashboard()
+        else:
+            for widget in self.main_frame.winfo_children():
+                if isinstance(widget, tk.Button):
+                    widget.destroy()
+
+        monitor = self.engine.liveness.get(self.engine.server)
+        rtt = None
+        if monitor is not None and self.engine.started_at is not None:
+            rtt = ([timestamp - self.engine.started_at for timestamp, _ in monitor.samples],
+                   [value for _, value in monitor.samples])
+        with instrumentation.span('plot'):
+            self.live_plot.show_all(self.elapsed_series(upl, samples.CONST_UPLOAD),
+                                    self.elapsed_series(dowl, samples.CONST_DOWNLOAD), rtt=rtt)
+
+        result_text = self.result_text
+        result_text.delete('1.0', tk.END)
+        average_upl, average_dowl = self.engine.average_bandwidth(upl=upl, dowl=dowl)
+        if average_upl is None or average_dowl is None:
             messagebox.showerror(title="Average Bandwidth State", message="Average bandwidth error", parent=self)
             return
-        result_text.insert(tk.END, f"Upload: {average_upl} Mbps\n"
-                                   f"Download: {average_dowl} Mbps\n"
-                                   f"Server: {self.server}\n"
-                                   f"Port: {self.port}\n"
-                                   f"Stream: {self.stream}\n"
-                                   f"Duration: {self.duration}\n")
+        result_text.insert(tk.END, f"Upload: {average_upl:.2f} Mbps\n"
+                                   f"Download: {average_dowl:.2f} Mbps\n"
+                                   f"Server: {self.engine.server}\n"
+                                   f"Port: {self.engine.port}\n"
+                                   f"Stream: {self.engine.stream}\n"
+                                   f"Duration: {self.engine.duration}\n")
+        for direction, summary in stats.run_stats(upl, dowl).items():
+            if summary['count']:
+                result_text.insert(tk.END, f"{direction.capitalize()} p5/p50/p95: {summary['p5']:.1f} / "
+                                           f"{summary['p50']:.1f} / {summary['p95']:.1f} Mbps, "
+                                           f"CV {summary['cv'] or 0:.2f}, {summary['outliers']} outliers\n")
+        if monitor is not None:
+            probe_stats = monitor.stats()
+            result_text.insert(tk.END, f"RTT: {probe_stats['rtt_ms']} ms\n"
+                                       f"Jitter: {probe_stats['jitter_ms']} ms\n"
+                                       f"Loss: {probe_stats['loss_percent']} %\n")
 
     def bandwidth_test(self):
         self.clear_main_frame()
@@ -317,13 +356,64 @@ class BandwidthTest(tk.Tk):
         start_button = tk.Button(self.main_frame, text='Start', command=self.run_multiple_tests)
         start_button.pack(pady=10)
 
-    @staticmethod
-    def average_bandwidth(upl, dowl):
-        if len(upl) == 0 or len(dowl) == 0:
-            return 'error', 'error'
-        average_upl = sum(upl) / len(upl)
-        average_dowl = sum(dowl) / len(dowl)
-        return average_upl, average_dowl
+    def multi_server_test(self):
+        self.clear_main_frame()
+
+        if not self.servers:
+            tk.Label(self.main_frame, text="Add a server list in Configure Server first").pack(pady=10)
+            return
+        tk.Label(self.main_frame, text=f"Servers: {self.servers}").pack(pady=10)
+        start_button = tk.Button(self.main_frame, text='Start', command=self.run_fanout_tests)
+        start_button.pack(pady=10)
+
+    def run_fanout_tests(self):
+        from async_engine import AsyncBridge, AsyncFanOut
+
+        def finish_fanout(future):
+            self.fanout = None
+            self.stop_loading()
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                messagebox.showerror(title="Multi-server test", message=str(future.exception()), parent=self)
+                return
+            rows = future.result()
+            self.display_fanout_table(rows, FanOut.best(rows))
+
+        if self.bridge is None:
+            self.bridge = AsyncBridge(self.events)
+        self.fanout = AsyncFanOut(parse_targets(self.servers, default_port=self.engine.port),
+                                  duration=self.engine.duration, stream=self.engine.stream, mode=self.engine.mode,
+                                  store=self.store)
+        self.bridge.submit(self.fanout.run_async(), on_done=finish_fanout)
+        self.loading()
+
+    def display_fanout_table(self, rows, best):
+        self.clear_main_frame()
+        columns = ('server', 'port', 'average_upload_Mbps', 'average_download_Mbps', 'attempts', 'passed')
+        table = ttk.Treeview(self.main_frame, columns=columns, show='headings')
+        for column in columns:
+            table.heading(column, text=column)
+            table.column(column, width=120)
+        for row in rows:
+            table.insert('', tk.END, values=[row[column] for column in columns])
+        table.pack(fill=tk.BOTH, expand=1)
+
+        best_text = f"Best: {best['server']}:{best['port']}" if best else "No target passed"
+        tk.Label(self.main_frame, text=best_text, font=("Times New Roman", 14)).pack(pady=10)
+
+    def show_history(self):
+        self.clear_main_frame()
+        columns = ('run_id', 'started_at', 'server', 'port', 'band', 'rssi', 'average_upload_Mbps',
+                   'average_download_Mbps', 'passed')
+        table = ttk.Treeview(self.main_frame, columns=columns, show='headings')
+        for column in columns:
+            table.heading(column, text=column)
+            table.column(column, width=85)
+        for run in self.store.query_runs(limit=CONST_HISTORY_LIMIT):
+            run['started_at'] = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started_at']))
+            table.insert('', tk.END, values=[run[column] for column in columns])
+        table.pack(fill=tk.BOTH, expand=1)
 
     def testing_power_wifi(self):
         self.clear_main_frame()
@@ -332,131 +422,89 @@ class BandwidthTest(tk.Tk):
         start_button.pack(pady=10)
 
     def start_power_wifi_test(self):
-        def display_test_result():
-            for result in self.test_pass:
-                print(result)
-                if '2.4Ghz rssi passed' in result:
-                    rssi_2ghz_value = tk.Label(self.main_frame, text=result['2.4Ghz rssi passed'],
-                                               font=("Times New Roman", 20), fg="green")
-                    rssi_2ghz_value.grid(column=2, row=0)
-                elif '5.0Ghz rssi passed' in result:
-                    rssi_5ghz_value = tk.Label(self.main_frame, text=result['5.0Ghz rssi passed'],
-                                               font=("Times New Roman", 20), fg="green")
-                    rssi_5ghz_value.grid(column=2, row=1)
-                elif '2.4Ghz bandwidth passed' in result:
-                    bandwidth_2ghz_value = tk.Label(self.main_frame, text=result['2.4Ghz bandwidth passed'],
-                                                    font=("Times New Roman", 20), fg="green")
-                    bandwidth_2ghz_value.grid(column=2, row=2)
-                elif '5.0Ghz bandwidth passed' in result:
-                    bandwidth_5ghz_value = tk.Label(self.main_frame, text=result['5.0Ghz bandwidth passed'],
-                                                    font=("Times New Roman", 20), fg="green")
-                    bandwidth_5ghz_value.grid(column=2, row=3)
-
-        def log_result():
-            self.clear_main_frame()
-            print("log")
-            rssi_2ghz_label = tk.Label(self.main_frame, text="2.4 Ghz rssi test",
-                                       font=("Times New Roman", 20))
-            rssi_2ghz_label.grid(column=0, row=0)
-            rssi_2ghz_result = tk.Label(self.main_frame, font=("Times New Roman", 20), text="FAILED", fg="red")
-            rssi_2ghz_result.grid(column=1, row=0)
-
-            rssi_5ghz_label = tk.Label(self.main_frame, text="5.0 Ghz rssi test",
-                                       font=("Times New Roman", 20))
-            rssi_5ghz_label.grid(column=0, row=1)
-            rssi_5ghz_result = tk.Label(self.main_frame, font=("Times New Roman", 20), text="FAILED", fg="red")
-            rssi_5ghz_result.grid(column=1, row=1)
-
-            bandwidth_2ghz_label = tk.Label(self.main_frame, text="2.4 Ghz bandwidth test",
-                                            font=("Times New Roman", 20))
-            bandwidth_2ghz_label.grid(column=0, row=2)
-            bandwidth_2ghz_result = tk.Label(self.main_frame, font=("Times New Roman", 20), text="FAILED", fg="red")
-            bandwidth_2ghz_result.grid(column=1, row=2)
-
-            bandwidth_5ghz_label = tk.Label(self.main_frame, text="5.0 Ghz bandwidth test",
-                                            font=("Times New Roman", 20))
-            bandwidth_5ghz_label.grid(column=0, row=3)
-            bandwidth_5ghz_result = tk.Label(self.main_frame, font=("Times New Roman", 20), text="FAILED", fg="red")
-            bandwidth_5ghz_result.grid(column=1, row=3)
-
-            result_button = tk.Button(self.main_frame, text="See Result", command=display_test_result)
-            result_button.grid(column=1, row=4)
-
-            for result in self.test_pass:
-                if '2.4Ghz rssi passed' in result:
-                    rssi_2ghz_result.config(text="PASS", fg="green")
-                elif '5.0Ghz rssi passed' in result:
-                    rssi_5ghz_result.config(text="PASS", fg="green")
-                elif '2.4Ghz bandwidth passed' in result:
-                    if result['2.4Ghz bandwidth passed'] >= 75:
-                        bandwidth_2ghz_result.config(text="PASS", fg="green")
-                elif '5.0Ghz bandwidth passed' in result:
-                    if result['5.0Ghz bandwidth passed'] >= 280:
-                        bandwidth_5ghz_result.config(text="PASS", fg="green")
-
-        def test_5ghz():
-            rssi_5ghz_value = self.get_rssi_value()
-            if rssi_5ghz_value >= CONST_ACCEPTED_RSSI:
-                self.test_pass.append({'5.0Ghz rssi passed': rssi_5ghz_value})
-            run_10minutes_bandwidth_test('5.0Ghz')
-
-        def test_2ghz():
-            rssi_value = self.get_rssi_value()
-            if rssi_value >= CONST_ACCEPTED_RSSI:
-                self.test_pass.append({'2.4Ghz rssi passed': rssi_value})
-            run_10minutes_bandwidth_test('2.4Ghz')
-
-        def run_10minutes_bandwidth_test(frequency):
-            def test_wrapper():
-                self.clear_test_results()
-                print(frequency)
-                stop_event = threading.Event()
-                thread1 = threading.Thread(target=self.run_iperf3_test, args=(False, stop_event))
-                thread2 = threading.Thread(target=self.run_iperf3_test, args=(True, stop_event))
-                thread3 = threading.Thread(target=self.check_server_status, args=(stop_event,))
-
-                thread1.start()
-                thread3.start()
-
-                thread1.join()
-                sleep(1)
-                thread2.start()
-                thread2.join()
-
-                stop_event.set()
-
-                self.process_test_results()
-
-                if self.is_test_bandwidth_fail():
-                    messagebox.showerror("failed")
-                    self.stop_loading()
-                    return
-
-                average_upl, average_dowl = self.average_bandwidth(self.upl, self.dowl)
-                self.stop_loading()
-                if frequency == '2.4Ghz':
-                    self.test_pass.append({'2.4Ghz bandwidth passed': average_dowl})
-                    messagebox.showinfo(message="test complete")
-                    config_label = tk.Label(self.main_frame, text="wait for config the AP to 5.0Ghz ...")
-                    config_label.pack()
-
-                    start_button = tk.Button(self.main_frame, text="start", command=test_5ghz)
-                    start_button.pack()
-                elif frequency == '5.0Ghz':
-                    self.test_pass.append({'5.0Ghz bandwidth passed': average_dowl})
-                    messagebox.showinfo(message="test complete")
-                    self.stop_loading()
-                    log_result()
-                return
-
-            threading.Thread(target=test_wrapper).start()
-            self.loading()
+        try:
+            plan = load_plan(CONST_POWER_WIFI_PLAN)
+        except (OSError, ValueError, RuntimeError) as e:
+            messagebox.showerror(title="Power Wifi Test", message=f"Cannot load {CONST_POWER_WIFI_PLAN}: {e}",
+                                 parent=self)
+            return
+        self.campaign = Campaign(plan, self.engine, operator=self.wait_for_operator,
+                                 on_step=lambda step, status, result: self.events.call(self.on_campaign_step, step,
+                                                                                       status))
+        # A stage that failed or was stopped midway picks up after the last completed step
+        checkpoint = self.campaign.load_checkpoint()
+        resume = bool(checkpoint and checkpoint['completed']) and messagebox.askyesno(
+            title="Power Wifi Test", parent=self,
+            message=f"Resume the previous run? {len(checkpoint['completed'])} steps are already done.")
+
+        def run_campaign():
+            try:
+                self.campaign.run(resume=resume)
+            finally:
+                # Also after an unexpected error (the state then says so), or the GUI stays on the spinner
+                self.events.call(self.finish_campaign)
 
         self.clear_main_frame()
+        threading.Thread(target=run_campaign, daemon=True).start()
 
-        self.test_pass = []
+    def wait_for_operator(self, message):
+        # Called on the campaign thread: show the prompt on the Tk thread and block until Start or Stop
+        confirmed = threading.Event()
+        self._operator_confirmed = confirmed
+        self.events.call(self.show_operator_prompt, message, confirmed)
+        confirmed.wait()
+        self._operator_confirmed = None
 
-        test_2ghz()
+    def show_operator_prompt(self, message, confirmed):
+        self.clear_main_frame()
+        tk.Label(self.main_frame, text=message).pack(pady=10)
+        tk.Button(self.main_frame, text="Start", command=confirmed.set).pack()
+        tk.Button(self.main_frame, text="Stop", command=self.stop_test).pack(pady=10)
+
+    def on_campaign_step(self, step, status):
+        if step['type'] == 'bandwidth':
+            if status == 'started':
+                self.loading()
+                self.start_live_results()
+            elif status == 'finished':
+                self._test_running = False
+                self.stop_loading()
+        elif step['type'] in ('rssi', 'health') and status == 'started':
+            self.clear_main_frame()
+            tk.Label(self.main_frame, text=f"Running {step.get('label', step['id'])} ...").pack(pady=10)
+
+    def finish_campaign(self):
+        self._test_running = False
+        self.stop_loading()
+        state = self.campaign.state
+        if state['status'] == 'cancelled' and (self.engine.upl or self.engine.dowl):
+            self.show_stopped_test()
+            return
+        if state['status'] == 'error':
+            messagebox.showerror(title="Power Wifi Test", parent=self,
+                                 message=f"{state['error']}\nStart the test again to resume from this step.")
+        elif state.get('aborted_by'):
+            messagebox.showinfo(title="Power Wifi Test", parent=self,
+                                message="The test failed hard; the remaining steps were skipped.")
+        self.log_campaign_result()
+
+    def log_campaign_result(self):
+        self.clear_main_frame()
+        lines = []
+        for step, result in self.campaign.results():
+            if 'rssi_passed' in result:
+                # Judged on the bandwidth step's in-run average, but still its own line for the operator
+                lines.append((f"{result['band'] or ''} rssi test".strip(), result['rssi_passed'], result['rssi']))
+            if 'passed' in result:
+                lines.append((step.get('label', step['id']), result['passed'],
+                              result.get('signal_dBm', result.get('average_download_Mbps', result.get('rtt_ms')))))
+        for row, (label, passed, value) in enumerate(lines):
+            tk.Label(self.main_frame, text=label, font=("Times New Roman", 20)).grid(column=0, row=row)
+            tk.Label(self.main_frame, font=("Times New Roman", 20), text="PASS" if passed else "FAILED",
+                     fg="green" if passed else "red").grid(column=1, row=row)
+            if value is not None:
+                tk.Label(self.main_frame, text=round(value, 1), font=("Times New Roman", 20),
+                         fg="green" if passed else "red").grid(column=2, row=row)
 
     def configure_setting(self):
         self.clear_main_frame()
@@ -472,87 +520,79 @@ class BandwidthTest(tk.Tk):
         tk.Label(self.main_frame, text="Enter No. Stream:", font=("Times New Roman", 14)).grid(row=3, column=0)
         self.StreamChosen = tk.Entry(self.main_frame, font=("Times New Roman", 14))
         self.StreamChosen.grid(column=1, row=3)
+        tk.Button(self.main_frame, text="Auto", command=self.auto_tune_streams).grid(column=2, row=3)
 
         tk.Label(self.main_frame, text="Enter No. Port:", font=("Times New Roman", 14)).grid(row=4, column=0)
         self.PortChosen = tk.Entry(self.main_frame, font=("Times New Roman", 14))
         self.PortChosen.grid(column=1, row=4)
 
+        tk.Label(self.main_frame, text="Test Mode:", font=("Times New Roman", 14)).grid(row=5, column=0)
+        self.ModeChosen = ttk.Combobox(self.main_frame, values=scheduler.CONST_MODES, state='readonly')
+        self.ModeChosen.set(self.engine.mode)
+        self.ModeChosen.grid(column=1, row=5)
+
+        tk.Label(self.main_frame, text="Run First:", font=("Times New Roman", 14)).grid(row=6, column=0)
+        self.OrderChosen = ttk.Combobox(self.main_frame, values=scheduler.CONST_DIRECTIONS, state='readonly')
+        self.OrderChosen.set(self.engine.order[0])
+        self.OrderChosen.grid(column=1, row=6)
+
+        tk.Label(self.main_frame, text="Server List:", font=("Times New Roman", 14)).grid(row=7, column=0)
+        self.ServerListChosen = tk.Entry(self.main_frame, font=("Times New Roman", 14))
+        self.ServerListChosen.insert(0, self.servers)
+        self.ServerListChosen.grid(column=1, row=7)
+        tk.Label(self.main_frame, text="e.g. 10.0.0.1:5201-5210, 10.0.0.2").grid(row=8, column=1)
+
         save_button = tk.Button(self.main_frame, text="Save", command=self.save_selection)
-        save_button.grid(column=1, row=5)
+        save_button.grid(column=1, row=9)
 
-    @staticmethod
-    def get_wifi_interface():
-        command = [
-            'lshw',
-            '-C',
-            'network',
-            '-json'
-        ]
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout, stderr = process.communicate()
-        result = json.loads(stdout)
-        for res in result:
-            if res["description"] == "Wireless interface":
-                return res["logicalname"]
-
-    def get_rssi_value(self):
-        wireless_interface = self.get_wifi_interface()
-        result = subprocess.run(['iwconfig', wireless_interface], capture_output=True, text=True)
-        for line in result.stdout.splitlines():
-            data = line.split()
-            for word in data:
-                if "Tx-Power" in word:
-                    return int(word[9:])
-        """
-        wireless_interface = self.get_wifi_interface()
-        result = subprocess.run(['iwconfig', wireless_interface], capture_output=True, text=True)
-        line = next(line for line in result.stdout.splitlines() if 'Link' in line)
-        line = line.replace('/100', '').replace('=', ' ')
-        parts = line.split()
-        signal = parts[5]
-        return int(signal)
-        """
+    def auto_tune_streams(self):
+        # Cached per server and band; only a new server (or a stale entry) runs the sweep
+        def tune_wrapper():
+            choice = self.tuner.tuned(self.engine.server, self.engine.port, band=self.engine.band)
+            self.tuner = None
+            self.stop_loading()
+            self.events.call(self.finish_tuning, choice)
+
+        self.tuner = StreamTuner(cache=TuningCache(), wifi=self.engine.wifi)
+        threading.Thread(target=tune_wrapper).start()
+        self.loading()
+
+    def finish_tuning(self, choice):
+        self.configure_setting()
+        if choice is None:
+            messagebox.showerror(title="Auto-tune", message="No stream count produced a result", parent=self)
+            return
+        self.engine.stream = choice['stream']
+        self.engine.window = choice['window']
+        messagebox.showinfo(title="Auto-tune", parent=self,
+                            message=f"Using {choice['stream']} streams, window {choice['window'] or 'default'}: "
+                                    f"{choice['Mbps']:.1f} Mbps (peak {choice['peak_Mbps']:.1f})")
 
     def clear_main_frame(self):
         for widget in self.main_frame.winfo_children():
             widget.destroy()
 
-    def clear_test_results(self):
-        self.test_results.clear()
-        self.upl.clear()
-        self.dowl.clear()
-        self.error_cnt = 0
-
-    def process_test_results(self):
-        for result in self.test_results:
-            if 'sent_Mbps' in result:
-                self.upl.append(round(result['sent_Mbps'], 1))
-            elif 'received_Mbps' in result:
-                self.dowl.append(round(result['received_Mbps'], 1))
-            elif 'server_status' in result:
-                if result['server_status'] == 'down':
-                    print("Server is down")
-            elif 'error' in result:
-                self.error_cnt += 1
-                print('error', self.error_cnt)
-
-    def is_test_bandwidth_fail(self):
-        return (self.error_cnt >= self.duration/5) or len(self.upl) == 0 or len(self.dowl) == 0
-
     def save_selection(self):
         server = self.ServerChosen.get()
         duration = self.DurationChosen.get()
         stream = self.StreamChosen.get()
         port = self.PortChosen.get()
+        mode = self.ModeChosen.get()
+        first = self.OrderChosen.get()
+        self.servers = self.ServerListChosen.get().strip()
 
         if len(server) > 0:
-            self.server = server
+            self.engine.server = server
         if duration:
-            self.duration = int(duration)
+            self.engine.duration = int(duration)
         if stream:
-            self.stream = int(stream)
+            self.engine.stream = int(stream)
         if port:
-            self.port = int(port)
+            self.engine.port = int(port)
+        if mode:
+            self.engine.mode = mode
+        if first:
+            self.engine.order = tuple(sorted(scheduler.CONST_DIRECTIONS, key=lambda direction: direction != first))
 
         messagebox.showinfo(title='save state', message="save completed", parent=self)
         for widget in self.main_frame.winfo_children():
@@ -560,5 +600,6 @@ class BandwidthTest(tk.Tk):
 
 
 if __name__ == '__main__':
+    instrumentation.configure_logging('INFO')
     app = BandwidthTest()
     app.mainloop()
@@ -0,0 +1,344 @@
+import asyncio
+import logging
+import signal
+import subprocess
+import threading
+import time
+
+from engine import BandwidthEngine
+from fanout import FanOut, CONST_BUSY_ERROR
+import instrumentation
+import iperf_client
+from liveness import LivenessMonitor
+import samples
+import scheduler
+import supervisor
+from wifi import WifiSampler
+
+
+# StreamReader's default 64 KiB line limit is below one --json-stream interval of a -P 128 run
+CONST_LINE_LIMIT = 16 * 1024 * 1024
+CONST_MAX_CONCURRENCY = 64
+# Same escalation as ProcessSupervisor: SIGINT lets iperf3 flush its last interval and summary
+CONST_SIGNAL_STEPS = (
+    (signal.SIGINT, supervisor.CONST_SIGINT_GRACE),
+    (signal.SIGTERM, supervisor.CONST_SIGTERM_GRACE),
+    (signal.SIGKILL, None),
+)
+
+log = logging.getLogger(__name__)
+
+
+async def spawn(command, create=None):
+    # create(command) stands in for asyncio.create_subprocess_exec, as ProcessSupervisor's popen does for
+    # Popen: replay.ReplayPopen.create plays recorded output back on the loop
+    program = command[0]
+    instrumentation.count('subprocesses_spawned', program=program)
+    log.debug("spawn: %s", ' '.join(command))
+    with instrumentation.span('spawn', program=program):
+        if create is not None:
+            return await create(command)
+        return await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                    stdin=subprocess.DEVNULL, limit=CONST_LINE_LIMIT)
+
+
+async def stop_process(process):
+    for signum, grace in CONST_SIGNAL_STEPS:
+        try:
+            process.send_signal(signum)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+            return
+        except TimeoutError:
+            continue
+
+
+async def stop_on_event(process, stop_event):
+    await stop_event.wait()
+    await stop_process(process)
+
+
+async def wait_event(event, timeout):
+    # asyncio counterpart of threading.Event.wait(timeout): True if the event fired
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except TimeoutError:
+        pass
+    return event.is_set()
+
+
+class AsyncBandwidthEngine(BandwidthEngine):
+    # The same test, results and summary as BandwidthEngine, but every client, probe and sampler is a task on
+    # one event loop instead of an OS thread blocked on a pipe. run_tests() keeps the blocking interface, so
+    # Campaign and the CLI can use either engine.
+    def __init__(self, *args, create=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.create = create
+        self._loop = None
+
+    def run_tests(self):
+        asyncio.run(self.run_tests_async())
+
+    def cancel(self):
+        # May be called from any thread; the stop event belongs to the engine's loop
+        self.cancelled = True
+        if self._loop is not None and self.stop_event is not None:
+            self._loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def run_tests_async(self):
+        self.clear_test_results()
+        self.cancelled = False
+        self.run_id = None
+        self.started_at = time.time()
+        self._loop = asyncio.get_running_loop()
+        self.stop_event = stop_event = asyncio.Event()
+        test_scheduler = scheduler.TestScheduler(None, self.test_targets(), mode=self.mode, order=self.order,
+                                                 gap=self.gap)
+        # A failing task cancels its siblings, and nothing outlives the group: no orphaned iperf3 or ping
+        async with asyncio.TaskGroup() as group:
+            for server, _ in test_scheduler.targets:
+                group.create_task(self.check_server_status_async(stop_event, server))
+            group.create_task(self.sample_wifi_async(stop_event))
+            try:
+                await self.run_waves(test_scheduler.plan(), stop_event)
+            finally:
+                stop_event.set()
+
+        wifi_stats = self.wifi_sampler.stats() if self.wifi_sampler is not None else None
+        if wifi_stats and wifi_stats['signal_dBm'] is not None:
+            self.rssi = round(wifi_stats['signal_dBm'])
+        with instrumentation.span('process_results'):
+            self.process_test_results()
+        if self.store is not None:
+            with instrumentation.span('store'):
+                self.run_id = await asyncio.to_thread(self.store.save_run, self.summary(), self.interval_samples(),
+                                                      band=self.band, rssi=self.rssi, started_at=self.started_at)
+
+    async def run_waves(self, waves, stop_event):
+        for index, wave in enumerate(waves):
+            if stop_event.is_set():
+                break
+            if index and await wait_event(stop_event, self.gap):
+                break
+            async with asyncio.TaskGroup() as group:
+                for direction, server, port in wave:
+                    group.create_task(self.run_iperf3_test_async(direction == 'download', stop_event, server=server,
+                                                                 port=port, bidir=direction == 'bidir'))
+
+    async def run_iperf3_test_async(self, reverse, stop_event, server=None, port=None, bidir=False):
+        if stop_event.is_set():
+            return
+
+        # Cached after the first call, so only the very first test pays for `iperf3 --version`
+        json_stream = await asyncio.to_thread(iperf_client.supports_json_stream, self.supervisor)
+        command = iperf_client.build_command(server or self.server, port or self.port, self.duration, self.stream,
+                                             reverse=reverse, json_stream=json_stream, bidir=bidir,
+                                             window=self.window)
+        parser = iperf_client.IntervalParser(json_stream, self.stream, buffer=self.samples,
+                                             direction=samples.CONST_DOWNLOAD if reverse else samples.CONST_UPLOAD)
+        direction = 'bidir' if bidir else 'download' if reverse else 'upload'
+        detectors = self.convergence_detectors(bidir)
+
+        try:
+            process = await spawn(command, self.create)
+        except OSError as e:
+            log.error("could not start iperf3: %s", e)
+            self.report_result({'error': str(e)})
+            return
+
+        watcher = asyncio.create_task(stop_on_event(process, stop_event))
+        try:
+            await asyncio.wait_for(self.read_intervals(process, parser, reverse, direction, detectors),
+                                   self.timeout)
+        except TimeoutError:
+            log.warning("iperf3 run timed out after %ss", self.timeout)
+            instrumentation.count('iperf3_errors', direction='timeout')
+            self.report_result({'error': f"iperf3 run timed out after {self.timeout}s"})
+            await stop_process(process)
+        except asyncio.CancelledError:
+            # Cancelled by the task group or a shutdown: there is nobody left to read a graceful flush
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        finally:
+            # After a stop the watcher is still escalating; leave it to finish the job
+            if not stop_event.is_set() or process.returncode is not None:
+                watcher.cancel()
+        await process.wait()
+
+    async def read_intervals(self, process, parser, reverse, direction, detectors=None):
+        # As in the threaded engine, read to EOF after a stop: iperf3 flushes its last interval on SIGINT
+        waited = parsed = 0.0
+        stopping = None
+        mark = time.perf_counter()
+        async for line in process.stdout:
+            read_at = time.perf_counter()
+            event = parser.parse_line(line.decode(errors='replace'))
+            waited += read_at - mark
+            mark = time.perf_counter()
+            parsed += mark - read_at
+            if event is not None:
+                self.handle_event(event, reverse, direction)
+                if self.check_convergence(detectors, event, direction):
+                    # Only this client stops; reading carries on to collect its final flush
+                    stopping = asyncio.create_task(stop_process(process))
+        if stopping is not None:
+            await stopping
+        instrumentation.observe('iperf3_wait', waited, direction=direction)
+        instrumentation.observe('parse', parsed, direction=direction)
+        if parser.errors:
+            instrumentation.count('parse_errors', parser.errors, direction=direction)
+
+    async def check_server_status_async(self, stop_event, server=None):
+        server = server or self.server
+        monitor = LivenessMonitor(server, port=self.port, method=self.probe, supervisor=self.supervisor)
+        self.liveness[server] = monitor
+        if monitor.method == 'tcp':
+            await self._probe_tcp(monitor, stop_event)
+        else:
+            await self._probe_ping(monitor, stop_event)
+        if monitor.server_down:
+            self.report_result({'server_status': 'down'})
+
+    async def _probe_ping(self, monitor, stop_event):
+        try:
+            process = await spawn(monitor.ping_command(), self.create)
+        except OSError as e:
+            log.error("server check error: %s", e)
+            return
+
+        # The stop event ends ping through the watcher, which also ends this loop at EOF
+        watcher = asyncio.create_task(stop_on_event(process, stop_event))
+        try:
+            async for line in process.stdout:
+                monitor.feed(line.decode(errors='replace'), stop_event)
+            if await process.wait() != 0 and not stop_event.is_set():
+                log.warning("server check for %s exited with %s", monitor.server, process.returncode)
+                monitor.server_down = True
+                stop_event.set()
+        finally:
+            watcher.cancel()
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    async def _probe_tcp(self, monitor, stop_event):
+        while not stop_event.is_set():
+            start_time = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(monitor.server, monitor.port),
+                                                   monitor.timeout)
+                rtt = (time.perf_counter() - start_time) * 1000
+                writer.close()
+            except OSError:
+                rtt = None
+            monitor.record(rtt, stop_event)
+            await wait_event(stop_event, monitor.interval)
+
+    async def sample_wifi_async(self, stop_event):
+        self.wifi_sampler = None
+        interface = self.wifi.wireless_interface()
+        if interface is None:
+            return
+        self.wifi_sampler = WifiSampler(self.wifi, interface)
+        # A /proc and /sys read per second is too quick to be worth a thread
+        while True:
+            self.wifi_sampler.record()
+            if await wait_event(stop_event, self.wifi_sampler.interval):
+                return
+
+
+class AsyncFanOut(FanOut):
+    # FanOut on one event loop: max_workers becomes a semaphore rather than a thread pool, so hundreds of
+    # targets cost hundreds of tasks and child processes, not hundreds of threads
+    def __init__(self, targets, max_workers=CONST_MAX_CONCURRENCY, create=None, **kwargs):
+        super().__init__(targets, max_workers=max_workers, **kwargs)
+        self.create = create
+        self._loop = None
+        self._cancelled = None
+
+    def run(self):
+        return asyncio.run(self.run_async())
+
+    async def run_async(self):
+        self.rows = []
+        self._loop = asyncio.get_running_loop()
+        self._cancelled = asyncio.Event()
+        if self.cancelled.is_set():
+            self._cancelled.set()
+        semaphore = asyncio.Semaphore(self.max_workers)
+        async with asyncio.TaskGroup() as group:
+            for server, port in self.targets:
+                group.create_task(self.run_target_async(server, port, semaphore))
+        self.rows.sort(key=lambda row: (row['server'], row['port']))
+        return self.rows
+
+    async def run_target_async(self, server, port, semaphore):
+        async with semaphore:
+            start_time = time.time()
+            attempt = 0
+            while True:
+                attempt += 1
+                engine = self.new_engine(server, port, AsyncBandwidthEngine, create=self.create)
+                self._engines.add(engine)
+                if not self._cancelled.is_set():
+                    await engine.run_tests_async()
+                self._engines.discard(engine)
+                summary = engine.summary()
+                busy = any(CONST_BUSY_ERROR in error for error in summary['errors'])
+                if not busy or attempt >= self.retries or await wait_event(self._cancelled,
+                                                                           self.retry_delay * attempt):
+                    break
+        row = self.make_row(summary, server, port, attempt, busy, start_time)
+        self.rows.append(row)
+        return row
+
+    def cancel(self):
+        self.cancelled.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        self._cancelled.set()
+        for engine in list(self._engines):
+            engine.cancel()
+
+
+class AsyncBridge:
+    # One event loop on one background thread for the Tk app. Tk code submits coroutines and gets
+    # concurrent futures back; completions are delivered on the Tk thread through the UI event queue.
+    def __init__(self, events):
+        self.events = events
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='asyncio-bridge', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine, on_done=None):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if on_done is not None:
+            future.add_done_callback(lambda done: self.events.call(on_done, done))
+        return future
+
+    async def _shutdown(self):
+        # Cancel everything and let it unwind before the loop stops: the cancelled clients kill and reap
+        # their iperf3 and ping children on the way out, which they can't do on a stopped loop
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.loop.shutdown_asyncgens()
+        await self.loop.shutdown_default_executor()
+        self.loop.stop()
+
+    def close(self):
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+            self._thread.join()
+        self.loop.close()
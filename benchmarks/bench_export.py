@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export  # noqa: E402
+from store import ResultStore  # noqa: E402
+
+
+CONST_SAMPLE_COUNTS = (6000, 60000, 600000)
+CONST_RUN_SAMPLES = 6000
+CONST_METHODS = ('legacy_xlsx', 'run_xlsx', 'xlsx', 'csv', 'parquet')
+
+
+def legacy_xlsx(path, upl, dowl):
+    # The cell-by-cell export this module replaced, kept as the baseline
+    import openpyxl
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet['A1'].value = "Upload (Mbps)"
+    sheet['B1'].value = "Download (Mbps)"
+    for row, data in enumerate(upl, start=2):
+        sheet[f'A{row}'].value = data
+    for row, data in enumerate(dowl, start=2):
+        sheet[f'B{row}'].value = data
+    wb.save(path)
+
+
+def build_store(path, samples):
+    store = ResultStore(path)
+    summary = {'server': '127.0.0.1', 'port': 5201, 'stream': 10, 'duration': 600, 'mode': 'sequential',
+               'average_upload_Mbps': 300.0, 'average_download_Mbps': 900.0, 'passed': True}
+    run_ids = []
+    now = time.time()
+    for run in range(max(1, samples // CONST_RUN_SAMPLES)):
+        rows = ((now + index * 0.1, 'upload' if index % 2 else 'download', random.uniform(250, 950))
+                for index in range(min(samples, CONST_RUN_SAMPLES)))
+        run_ids.append(store.save_run(summary, rows, band='5.0Ghz'))
+    return store, run_ids
+
+
+def child(method, samples, workdir):
+    # Runs in its own process so ru_maxrss is the peak of this export alone
+    path = os.path.join(workdir, f'out.{method}')
+    if method in ('legacy_xlsx', 'run_xlsx'):
+        # Single-run layout: upload and download side by side
+        upl = [random.uniform(250, 350) for _ in range(samples // 2)]
+        dowl = [random.uniform(850, 950) for _ in range(samples // 2)]
+        start_time = time.perf_counter()
+        if method == 'legacy_xlsx':
+            legacy_xlsx(path + '.xlsx', upl, dowl)
+        else:
+            export.export_run_xlsx(path + '.xlsx', upl, dowl, 300.0, 900.0)
+    else:
+        store, run_ids = build_store(os.path.join(workdir, 'bench.db'), samples)
+        start_time = time.perf_counter()
+        export.export_runs(store, run_ids, path, fmt=method)
+    elapsed = time.perf_counter() - start_time
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed:.3f} {peak_kb}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export time and peak RSS against sample count")
+    parser.add_argument('--samples', type=int, nargs='*', default=CONST_SAMPLE_COUNTS)
+    parser.add_argument('--methods', nargs='*', default=CONST_METHODS, choices=CONST_METHODS)
+    parser.add_argument('--child', nargs=2, metavar=('METHOD', 'SAMPLES'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with tempfile.TemporaryDirectory() as workdir:
+            child(args.child[0], int(args.child[1]), workdir)
+        return
+
+    print(f"{'method':<12} {'samples':>8} {'seconds':>9} {'peak RSS MB':>12}")
+    for samples in args.samples:
+        for method in args.methods:
+            result = subprocess.run([sys.executable, __file__, '--child', method, str(samples)],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"{method:<12} {samples:>8} failed: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            elapsed, peak_kb = result.stdout.split()
+            print(f"{method:<12} {samples:>8} {float(elapsed):>9.3f} {int(peak_kb) / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fanout import FanOut  # noqa: E402
+import replay  # noqa: E402
+
+
+CONST_TARGETS = (10, 50, 200)
+CONST_LINE_DELAY = 0.05
+CONST_ENGINES = ('async', 'threads')
+
+
+class ThreadPeak:
+    # Highest thread count seen while a fan-out runs; sampled, so very short-lived threads may be missed
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+
+def run_fanout(engine, targets, line_delay, workers):
+    # Replayed iperf3 and ping for every target: the real scheduler, parser and liveness code, no binaries
+    replay_popen = replay.default_replay(line_delay=line_delay)
+    supervisor = replay.replay_supervisor(replay_popen)
+    # One server per target, as a fan-out over many hosts would have
+    target_list = [(f"10.0.{index // 250}.{index % 250 + 1}", 5201) for index in range(targets)]
+    if engine == 'async':
+        from async_engine import AsyncFanOut
+        fanout = AsyncFanOut(target_list, max_workers=workers or targets, gap=0, supervisor=supervisor,
+                             create=replay_popen.create)
+    else:
+        fanout = FanOut(target_list, max_workers=workers or targets, gap=0, supervisor=supervisor)
+    start_time = time.perf_counter()
+    with ThreadPeak() as threads:
+        rows = fanout.run()
+    return rows, time.perf_counter() - start_time, threads.peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wall time and peak thread count of a replayed fan-out, asyncio "
+                                                 "engine against one thread per client")
+    parser.add_argument('--targets', type=int, nargs='*', default=CONST_TARGETS)
+    parser.add_argument('--engines', nargs='*', default=CONST_ENGINES, choices=CONST_ENGINES)
+    parser.add_argument('--line-delay', type=float, default=CONST_LINE_DELAY,
+                        help="seconds between replayed output lines (default: %(default)s)")
+    parser.add_argument('--workers', type=int, help="concurrent targets (default: all of them)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    failed = False
+    print(f"{'engine':<8} {'targets':>8} {'passed':>7} {'seconds':>9} {'peak threads':>13} {'threads after':>14}")
+    for targets in args.targets:
+        for engine in args.engines:
+            rows, elapsed, peak = run_fanout(engine, targets, args.line_delay, args.workers)
+            passed = sum(row['passed'] for row in rows)
+            failed = failed or len(rows) != targets or passed != targets
+            print(f"{engine:<8} {targets:>8} {passed:>7} {elapsed:>9.2f} {peak:>13} {threading.active_count():>14}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
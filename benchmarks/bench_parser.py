@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import iperf_parser  # noqa: E402
+
+
+CONST_STREAMS = (1, 10, 128)
+CONST_DURATION = 600
+CONST_REPEAT = 3
+
+
+def stream_entry(socket, start, sender=True):
+    bits = random.uniform(20e6, 40e6)
+    entry = {'socket': socket, 'start': start, 'end': start + 1, 'seconds': 1.0, 'bytes': int(bits / 8),
+             'bits_per_second': bits, 'omitted': False, 'sender': sender}
+    if sender:
+        entry.update({'retransmits': random.randint(0, 5), 'snd_cwnd': random.randint(100000, 900000),
+                      'snd_wnd': 3145728, 'rtt': random.randint(800, 20000), 'rttvar': random.randint(50, 900),
+                      'pmtu': 1500})
+    return entry
+
+
+def generate_report(streams, duration):
+    # Same layout and field set as `iperf3 -c ... -J -P N -t duration`
+    sockets = range(5, 5 + streams)
+    intervals = []
+    for second in range(duration):
+        entries = [stream_entry(socket, second) for socket in sockets]
+        total = sum(entry['bits_per_second'] for entry in entries)
+        intervals.append({
+            'streams': entries,
+            'sum': {'start': second, 'end': second + 1, 'seconds': 1.0, 'bytes': int(total / 8),
+                    'bits_per_second': total, 'retransmits': sum(entry['retransmits'] for entry in entries),
+                    'omitted': False, 'sender': True},
+        })
+    totals = {'start': 0, 'end': duration, 'seconds': duration, 'bytes': 10 ** 10, 'bits_per_second': 3e8,
+              'sender': True}
+    return {
+        'start': {'connected': [{'socket': socket, 'local_host': '10.0.0.2', 'local_port': 40000 + socket,
+                                 'remote_host': '10.0.0.1', 'remote_port': 5201} for socket in sockets],
+                  'version': 'iperf 3.17.1', 'timestamp': {'timesecs': int(time.time())},
+                  'test_start': {'protocol': 'TCP', 'num_streams': streams, 'duration': duration}},
+        'intervals': intervals,
+        'end': {
+            'streams': [{'sender': dict(totals, socket=socket), 'receiver': dict(totals, socket=socket)}
+                        for socket in sockets],
+            'sum_sent': dict(totals, retransmits=42),
+            'sum_received': dict(totals, sender=False),
+            'cpu_utilization_percent': {'host_total': 12.5, 'host_user': 1.2, 'host_system': 11.3,
+                                        'remote_total': 30.1, 'remote_user': 2.0, 'remote_system': 28.1},
+        },
+    }
+
+
+def stream_lines(report):
+    # The same run as `--json-stream` would print it
+    lines = [json.dumps({'event': 'start', 'data': report['start']})]
+    lines += [json.dumps({'event': 'interval', 'data': interval}) for interval in report['intervals']]
+    lines.append(json.dumps({'event': 'end', 'data': report['end']}))
+    return lines
+
+
+def full_json(text):
+    # What the engine used to do: build the whole tree, then read the sums out of it
+    document = json.loads(text)
+    return [interval['sum'] for interval in document['intervals']], document['end']
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="iperf3 JSON parsing time per approach and stream count")
+    parser.add_argument('--streams', type=int, nargs='*', default=CONST_STREAMS)
+    parser.add_argument('--duration', type=int, default=CONST_DURATION)
+    parser.add_argument('--repeat', type=int, default=CONST_REPEAT)
+    parser.add_argument('--fixture', nargs='*', default=[],
+                        help="recorded `iperf3 -J` outputs to time instead of generated ones")
+    args = parser.parse_args()
+
+    fixtures = []
+    for path in args.fixture:
+        with open(path) as handle:
+            fixtures.append((os.path.basename(path), handle.read()))
+    if not fixtures:
+        random.seed(0)
+        for streams in args.streams:
+            fixtures.append((f'-P {streams}', json.dumps(generate_report(streams, args.duration))))
+
+    methods = [
+        ('json.loads', full_json),
+        ('sums', lambda text: iperf_parser.parse_report(text)),
+        ('streams json', lambda text: iperf_parser.parse_report(text, streams=True, backend='json')),
+    ]
+    if iperf_parser.orjson is not None:
+        methods.append(('streams orjson',
+                        lambda text: iperf_parser.parse_report(text, streams=True, backend='orjson')))
+
+    print(f"{'fixture':<12} {'MB':>7} {'method':<15} {'seconds':>9}")
+    for name, text in fixtures:
+        size = len(text) / 1e6
+        for method, func in methods:
+            print(f"{name:<12} {size:>7.1f} {method:<15} {best_of(lambda: func(text), args.repeat):>9.4f}")
+
+        lines = stream_lines(json.loads(text))
+        for method, func in (('line json', lambda: [json.loads(line) for line in lines]),
+                             ('line sums', lambda: [iperf_parser.parse_stream_line(line, streams=False)
+                                                    for line in lines]),
+                             ('line streams', lambda: [iperf_parser.parse_stream_line(line) for line in lines]),
+                             ('line no orjson', lambda: [iperf_parser.parse_stream_line(line, backend='json')
+                                                         for line in lines])):
+            print(f"{name:<12} {size:>7.1f} {method:<15} {best_of(func, args.repeat):>9.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONST_ROUNDS = 7
+CONST_THRESHOLD = 0.25
+# Modules that must not be imported just to open the window
+CONST_HEAVY_MODULES = ('matplotlib', 'openpyxl', 'PIL', 'numpy', 'asyncio', 'http.server')
+
+# Runs in a fresh interpreter each round, so nothing is already cached by an earlier round
+_CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+timings = {'import_app': time.perf_counter() - start}
+heavy = [module for module in HEAVY if module in sys.modules]
+try:
+    root = app.BandwidthTest()
+except app.tk.TclError:
+    # No display: only the import figures can be measured
+    root = None
+if root is not None:
+    root.update()
+    timings['first_window'] = time.perf_counter() - start
+    start = time.perf_counter()
+    root.loading()
+    root.update()
+    timings['first_loading'] = time.perf_counter() - start
+    app.prewarm()
+    start = time.perf_counter()
+    second = app.BandwidthTest()
+    second.update()
+    second.loading()
+    second.update()
+    timings['new_window_loading'] = time.perf_counter() - start
+    start = time.perf_counter()
+    second.show_dashboard()
+    second.update()
+    timings['prewarmed_dashboard'] = time.perf_counter() - start
+    second.stop_loading()
+    second.destroy()
+    root.stop_loading()
+    root.destroy()
+print(json.dumps({'timings': timings, 'heavy': heavy}))
+'''
+
+
+def run_child():
+    code = f"HEAVY = {CONST_HEAVY_MODULES!r}\n{_CHILD}"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time of the GUI: importing app, the first window, the "
+                                                 "first loading animation and a second window")
+    parser.add_argument('--rounds', type=int, default=CONST_ROUNDS)
+    parser.add_argument('--save', help="write the medians to this JSON file as a baseline")
+    parser.add_argument('--compare', help="baseline JSON to compare against; exit 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=CONST_THRESHOLD,
+                        help="allowed median slowdown against the baseline (default: %(default)s = 25%%)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+
+    rounds = [run_child() for _ in range(args.rounds)]
+    heavy = sorted({module for result in rounds for module in result['heavy']})
+    results = {}
+    regressions = []
+    print(f"{'phase':<22} {'min ms':>9} {'median ms':>10} {'vs baseline':>12}")
+    for name in rounds[0]['timings']:
+        timings = [result['timings'][name] for result in rounds]
+        results[name] = statistics.median(timings)
+        change = ''
+        if name in baseline:
+            ratio = results[name] / baseline[name] - 1
+            change = f"{ratio:+.1%}"
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += ' !'
+        print(f"{name:<22} {min(timings) * 1e3:>9.1f} {results[name] * 1e3:>10.1f} {change:>12}")
+    if 'first_window' not in results:
+        print("(no display: window phases skipped)")
+    print(f"heavy modules loaded by `import app`: {', '.join(heavy) or 'none'}")
+
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if regressions:
+        print(f"Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+    if regressions or heavy:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
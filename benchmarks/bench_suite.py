@@ -0,0 +1,433 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_engine import AsyncBandwidthEngine  # noqa: E402
+from campaign import Campaign  # noqa: E402
+from engine import BandwidthEngine  # noqa: E402
+import export  # noqa: E402
+import iperf_client  # noqa: E402
+import iperf_parser  # noqa: E402
+import replay  # noqa: E402
+import samples  # noqa: E402
+import stats  # noqa: E402
+from store import ResultStore  # noqa: E402
+from ui_events import UIEventQueue  # noqa: E402
+
+from bench_parser import generate_report  # noqa: E402
+
+
+CONST_MIN_ROUNDS = 5
+CONST_MIN_SECONDS = 0.5
+CONST_THRESHOLD = 0.25
+# What the recorded fixtures hold: 10 one-second intervals per direction and these means, in Mbps
+CONST_INTERVALS = 10
+CONST_FIXTURE_MBPS = {
+    'json_stream': (309.893, 876.938),
+    'text': (307.9, 895.2),
+    'bidir': (289.363, 610.574),
+}
+
+_benchmarks = []
+_checks = []
+
+
+def benchmark(func):
+    _benchmarks.append(func)
+    return func
+
+
+def check(func):
+    _checks.append(func)
+    return func
+
+
+def expect(condition, message):
+    # Not `assert`: the checks must hold under python -O too
+    if not condition:
+        raise AssertionError(message)
+
+
+def expect_mbps(actual, expected, what):
+    expect(actual is not None and abs(actual - expected) < 0.01, f"{what}: {actual} Mbps, expected {expected}")
+
+
+def fixture_lines(name):
+    with open(os.path.join(replay.CONST_FIXTURES, 'iperf3', name)) as handle:
+        return handle.readlines()
+
+
+def replay_engine(replay_popen=None, **kwargs):
+    return BandwidthEngine(supervisor=replay.replay_supervisor(replay_popen), wifi=replay.replay_wifi(), gap=0,
+                           **kwargs)
+
+
+def replay_async_engine(replay_popen=None, **kwargs):
+    # The same fixtures through the asyncio engine: --version via the supervisor, iperf3 and ping on the loop
+    replay_popen = replay_popen or replay.default_replay()
+    return AsyncBandwidthEngine(supervisor=replay.replay_supervisor(replay_popen), create=replay_popen.create,
+                                wifi=replay.replay_wifi(), gap=0, **kwargs)
+
+
+def expect_fixture_run(engine, fixture='json_stream'):
+    upload, download = CONST_FIXTURE_MBPS[fixture]
+    expect(len(engine.upl) == CONST_INTERVALS and len(engine.dowl) == CONST_INTERVALS,
+           f"{len(engine.upl)} upload / {len(engine.dowl)} download intervals, expected {CONST_INTERVALS} each")
+    summary = engine.summary()
+    expect_mbps(summary['average_upload_Mbps'], upload, 'upload')
+    expect_mbps(summary['average_download_Mbps'], download, 'download')
+    expect(summary['passed'], f"replayed run failed: {summary['errors'] or summary['rule_failures']}")
+    return summary
+
+
+def parse_fixture(lines, json_stream):
+    parser = iperf_client.IntervalParser(json_stream, 10)
+    events = [event for event in map(parser.parse_line, lines) if event is not None]
+    intervals = [event['bits_per_second'] / 1e6 for event in events if event['event'] == 'interval']
+    return intervals, events, parser
+
+
+def expect_parsed(lines, json_stream, expected):
+    intervals, events, parser = parse_fixture(lines, json_stream)
+    expect(len(intervals) == CONST_INTERVALS, f"{len(intervals)} intervals parsed, expected {CONST_INTERVALS}")
+    expect_mbps(sum(intervals) / len(intervals), expected, 'parsed mean')
+    expect(any(event['event'] == 'end' for event in events), "no end event parsed")
+    expect(parser.errors == 0, f"{parser.errors} lines failed to parse")
+
+
+@benchmark
+def parse_json_stream():
+    lines = fixture_lines('upload_P10.jsonl')
+    expect_parsed(lines, True, CONST_FIXTURE_MBPS['json_stream'][0])
+
+    def run():
+        parser = iperf_client.IntervalParser(True, 10)
+        for line in lines:
+            parser.parse_line(line)
+    return run
+
+
+@benchmark
+def parse_text():
+    lines = fixture_lines('upload_P10.txt')
+    expect_parsed(lines, False, CONST_FIXTURE_MBPS['text'][0])
+
+    def run():
+        parser = iperf_client.IntervalParser(False, 10)
+        for line in lines:
+            parser.parse_line(line)
+    return run
+
+
+@benchmark
+def parse_report_P128():
+    report = generate_report(128, 60)
+    text = json.dumps(report)
+    parsed = iperf_parser.parse_report(text)
+    expect(len(parsed['intervals']) == 60, f"{len(parsed['intervals'])} intervals parsed, expected 60")
+    expect(all(interval['sum'] == expected['sum'] for interval, expected in zip(parsed['intervals'],
+                                                                                report['intervals'])),
+           "parsed interval sums differ from the report")
+    expect(parsed['end']['sum_sent'] == report['end']['sum_sent'], "end section sum_sent differs from the report")
+    return lambda: iperf_parser.parse_report(text)
+
+
+@benchmark
+def engine_run():
+    # Replayed upload + download through the real scheduler, supervisor, parser and result processing
+    def run():
+        engine = replay_engine()
+        engine.run_tests()
+        return engine
+
+    expect_fixture_run(run())
+    return lambda: run().summary()
+
+
+@benchmark
+def stats_batch_1000_runs():
+    engine = replay_engine()
+    engine.run_tests()
+    series = [engine.upl * 60] * 1000
+    batch = stats.summarize_batch(series)
+    single = stats.summarize(series[0])
+    expect(len(batch['mean']) == 1000, f"{len(batch['mean'])} batch rows, expected 1000")
+    expect(all(abs(batch[metric][-1] - single[metric]) < 1e-6 for metric in ('count', 'mean', 'p5', 'p95')),
+           "batch statistics differ from the single-run statistics")
+    return lambda: stats.summarize_batch(series)
+
+
+@benchmark
+def store_save_run():
+    engine = replay_engine()
+    engine.run_tests()
+    summary = engine.summary()
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    run_id = store.save_run(summary, engine.interval_samples(), band='5.0Ghz', rssi=engine.rssi)
+    expect(len(store.samples(run_id)) == 2 * CONST_INTERVALS, "stored samples differ from the run's intervals")
+    return lambda: store.save_run(summary, engine.interval_samples(), band='5.0Ghz', rssi=engine.rssi)
+
+
+@benchmark
+def export_run_xlsx_600():
+    path = os.path.join(tempfile.mkdtemp(), 'run.xlsx')
+    upl = [300.0 + index % 17 for index in range(600)]
+    dowl = [900.0 - index % 13 for index in range(600)]
+    return lambda: export.export_run_xlsx(path, upl, dowl, 308.0, 894.0)
+
+
+@benchmark
+def export_run_csv_600():
+    path = os.path.join(tempfile.mkdtemp(), 'run.csv')
+    upl = [300.0 + index % 17 for index in range(600)]
+    dowl = [900.0 - index % 13 for index in range(600)]
+    return lambda: export.export_run_csv(path, upl, dowl)
+
+
+class _FakeRoot:
+    # Enough of Tk for UIEventQueue: after() just records the callback
+    def after(self, ms, func, *args):
+        return None
+
+    def after_cancel(self, after_id):
+        pass
+
+
+@benchmark
+def ui_drain_1000_results():
+    # One drain of a second's worth of -P 128 results, coalesced into a single handler call
+    events = UIEventQueue(_FakeRoot())
+    received = []
+    events.register('result', received.extend, coalesce=True)
+
+    def run():
+        for index in range(1000):
+            events.post('result', {'sent_Mbps': 300.0, 'time': index})
+        events._drain()
+        received.clear()
+    return run
+
+
+@check
+def replay_modes():
+    for make_engine in (replay_engine, replay_async_engine):
+        for mode in ('sequential', 'concurrent'):
+            engine = make_engine(mode=mode)
+            engine.run_tests()
+            expect_fixture_run(engine)
+        engine = make_engine(mode='bidir')
+        engine.run_tests()
+        expect_fixture_run(engine, 'bidir')
+
+
+@check
+def replay_text_client():
+    # An iperf3 older than 3.17 has no --json-stream; its --forceflush text output must give the same run
+    engine = replay_engine(replay.default_replay(iperf3='text'))
+    engine.run_tests()
+    expect_fixture_run(engine, 'text')
+
+
+@check
+def replay_busy_server():
+    busy = replay.ReplayPopen()
+    busy.add('iperf3', 'iperf3/version_3.17.txt', args=('--version',))
+    busy.add('iperf3', 'iperf3/busy.jsonl')
+    busy.add('ping', 'ping/reply.txt', loop=True, line_delay=0.01)
+    engine = replay_engine(busy)
+    engine.run_tests()
+    summary = engine.summary()
+    expect(not summary['passed'], "a run against a busy server passed")
+    expect(len(summary['errors']) == 2 and all('busy' in error for error in summary['errors']),
+           f"busy errors not reported: {summary['errors']}")
+
+
+@check
+def replay_server_down():
+    # The monitor gives up after three lost pings, part-way through the run
+    for make_engine in (replay_engine, replay_async_engine):
+        for mode in ('concurrent', 'bidir'):
+            engine = make_engine(replay.default_replay(line_delay=0.3, ping='ping/lost.txt'), mode=mode)
+            engine.run_tests()
+            summary = engine.summary()
+            name = f"{type(engine).__name__} {mode}"
+            expect(summary['server_down'] and not summary['passed'], f"{name}: a run cut short by a dead server passed")
+            expect({'server_status': 'down'} in engine.test_results, f"{name}: server down not recorded")
+
+
+@check
+def replay_cancel():
+    for make_engine in (replay_engine, replay_async_engine):
+        store = ResultStore(os.path.join(tempfile.mkdtemp(), 'check.db'))
+        engine = make_engine(replay.default_replay(line_delay=0.1), mode='concurrent', store=store)
+        name = type(engine).__name__
+        timer = threading.Timer(0.8, engine.cancel)
+        timer.start()
+        engine.run_tests()
+        summary = engine.summary()
+        expect(summary['cancelled'] and not summary['passed'], f"{name}: a cancelled run passed")
+        expect(len(engine.upl) < CONST_INTERVALS, f"{name}: the cancel did not cut the run short")
+        expect(not store.query_runs()[0]['passed'], f"{name}: a cancelled run was stored as a pass")
+
+
+def run_campaign(plan, engine, checkpoint_path, cancel_after=None):
+    campaign = Campaign(plan, engine, checkpoint_path=checkpoint_path, operator=lambda message: None)
+    if cancel_after is not None:
+        threading.Timer(cancel_after, campaign.cancel).start()
+    return campaign.run(resume=True)
+
+
+@check
+def campaign_cancel_resume():
+    # A step cancelled part-way must not be checkpointed as done: the resume reruns it
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), 'check.checkpoint.json')
+    plan = {'name': 'check', 'steps': [{'id': 'rssi', 'type': 'rssi', 'seconds': 2},
+                                       {'id': 'bandwidth', 'type': 'bandwidth'}]}
+    state = run_campaign(plan, replay_engine(), checkpoint_path, cancel_after=0.5)
+    expect(state['status'] == 'cancelled' and not state['completed'],
+           f"cancelled RSSI step was checkpointed: {state['status']} {list(state['completed'])}")
+    state = run_campaign(plan, replay_engine(replay.default_replay(line_delay=0.1), mode='concurrent'),
+                         checkpoint_path, cancel_after=2.8)
+    expect(state['status'] == 'cancelled' and list(state['completed']) == ['rssi'],
+           f"cancelled bandwidth step was checkpointed: {state['status']} {list(state['completed'])}")
+    state = run_campaign(plan, replay_engine(), checkpoint_path)
+    expect(state['status'] == 'finished' and list(state['completed']) == ['rssi', 'bandwidth'],
+           f"resume after cancels did not finish the plan: {state['status']} {list(state['completed'])}")
+    expect(state['completed']['bandwidth']['passed'], "resumed bandwidth step failed")
+    expect(not os.path.exists(checkpoint_path), "finished campaign left its checkpoint behind")
+
+
+@check
+def campaign_server_down_resume():
+    # A dead test server is an infrastructure fault, not a FAIL of the device: the step reruns on resume
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), 'check.checkpoint.json')
+    plan = {'name': 'check', 'steps': [{'id': 'bandwidth', 'type': 'bandwidth'}]}
+    # Concurrent, so both directions have intervals and only server_down tells this run apart from a real one
+    state = run_campaign(plan, replay_engine(replay.default_replay(line_delay=0.3, ping='ping/lost.txt'),
+                                             mode='concurrent'), checkpoint_path)
+    expect(state['status'] == 'error' and not state['completed'] and os.path.exists(checkpoint_path),
+           f"server-down step was checkpointed: {state['status']} {list(state['completed'])}")
+    state = run_campaign(plan, replay_engine(), checkpoint_path)
+    expect(state['status'] == 'finished' and state['completed'].get('bandwidth', {}).get('passed'),
+           f"resume after a server-down did not pass: {state['status']} {list(state['completed'])}")
+
+
+@check
+def campaign_in_run_rssi():
+    # A bandwidth step's min_dBm judges the RSSI sampled during that run (the fixture reads -63 dBm)
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), 'check.checkpoint.json')
+    for threshold, passed in ((-70, True), (-50, False)):
+        plan = {'name': 'check', 'steps': [{'id': 'bandwidth', 'type': 'bandwidth', 'min_dBm': threshold}]}
+        result = run_campaign(plan, replay_engine(), checkpoint_path)['completed'].get('bandwidth', {})
+        expect(result.get('rssi') == -63 and result.get('rssi_passed') is passed and result.get('passed') is passed,
+               f"min_dBm {threshold} judged the in-run RSSI wrongly: {result}")
+
+
+@check
+def store_round_trip():
+    engine = replay_engine()
+    engine.run_tests()
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), 'check.db'))
+    run_id = store.save_run(engine.summary(), engine.interval_samples(), band='5.0Ghz', rssi=engine.rssi)
+    run = store.query_runs()[0]
+    expect(run['run_id'] == run_id and run['passed'] and run['rssi'] == engine.rssi, f"stored run differs: {run}")
+    expect([row[-1] for row in store.samples(run_id, samples.CONST_DIRECTION_NAMES[samples.CONST_UPLOAD])]
+           == engine.upl, "stored upload samples differ from the run's")
+
+
+def run_checks(keyword=None):
+    failures = []
+    for func in _checks:
+        if keyword and keyword not in func.__name__:
+            continue
+        try:
+            func()
+        except AssertionError as e:
+            failures.append(func.__name__)
+            print(f"check {func.__name__}: FAILED: {e}")
+        else:
+            print(f"check {func.__name__}: ok")
+    return failures
+
+
+def measure(setup):
+    func = setup()
+    func()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < CONST_MIN_ROUNDS or time.perf_counter() - started < CONST_MIN_SECONDS:
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'rounds': len(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay-driven correctness checks and benchmarks of the parsing, "
+                                                 "engine, export and UI update hot paths")
+    parser.add_argument('-k', dest='keyword', help="only run checks and benchmarks whose name contains this")
+    parser.add_argument('--save', help="write the medians to this JSON file as a baseline")
+    parser.add_argument('--compare', help="baseline JSON to compare against; exit 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=CONST_THRESHOLD,
+                        help="allowed median slowdown against the baseline (default: %(default)s = 25%%)")
+    args = parser.parse_args()
+    # The checks drive failing runs on purpose; their warnings are expected
+    logging.basicConfig(level=logging.ERROR)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+
+    # A benchmark of wrong output is meaningless, and a parser that yields nothing would look like a speedup
+    failures = run_checks(args.keyword)
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<24} {'min ms':>9} {'median ms':>10} {'mean ms':>9} {'rounds':>7} {'vs baseline':>12}")
+    for setup in _benchmarks:
+        name = setup.__name__
+        if args.keyword and args.keyword not in name:
+            continue
+        try:
+            result = measure(setup)
+        except AssertionError as e:
+            failures.append(name)
+            print(f"{name:<24} FAILED: {e}")
+            continue
+        results[name] = result['median']
+        change = ''
+        if name in baseline:
+            ratio = result['median'] / baseline[name] - 1
+            change = f"{ratio:+.1%}"
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += ' !'
+        print(f"{name:<24} {result['min'] * 1e3:>9.3f} {result['median'] * 1e3:>10.3f} "
+              f"{result['mean'] * 1e3:>9.3f} {result['rounds']:>7} {change:>12}")
+
+    if args.save and not failures:
+        with open(args.save, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if failures:
+        print(f"Wrong results: {', '.join(failures)}")
+    if regressions:
+        print(f"Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+    if failures or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from liveness import LivenessMonitor
+import stats
+from wifi import WifiSampler
+
+
+CONST_STEP_TYPES = ('rssi', 'bandwidth', 'wait_operator', 'band_switch', 'health', 'parallel')
+CONST_RSSI_SECONDS = 5
+CONST_HEALTH_SECONDS = 5
+CONST_ACCEPTED_RSSI = -50
+
+
+class StepError(Exception):
+    # The step could not produce a verdict (cancelled, no data, no Wi-Fi); it is not checkpointed and reruns on resume
+    pass
+
+
+def load_plan(path):
+    with open(path) as handle:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("YAML plans need PyYAML (pip install pyyaml); JSON plans work without it")
+            plan = yaml.safe_load(handle)
+        else:
+            plan = json.load(handle)
+    validate_plan(plan)
+    return plan
+
+
+def validate_plan(plan):
+    ids = set()
+
+    def check(steps, where):
+        if not isinstance(steps, list) or not steps:
+            raise ValueError(f"{where}: 'steps' must be a non-empty list")
+        for index, step in enumerate(steps):
+            step_type = step.get('type')
+            if step_type not in CONST_STEP_TYPES:
+                raise ValueError(f"{where} step {index}: unknown type {step_type!r}")
+            # Checkpoints are keyed by id, so ids must be stable and unique
+            step_id = step.get('id')
+            if not step_id or step_id in ids:
+                raise ValueError(f"{where} step {index}: missing or duplicate id {step_id!r}")
+            ids.add(step_id)
+            if step_type == 'parallel':
+                check(step.get('steps'), step_id)
+            elif step_type == 'band_switch' and not step.get('band'):
+                raise ValueError(f"{step_id}: band_switch needs a band")
+            for rule in step.get('hard_rules', []):
+                stats.parse_rule(rule)
+
+    check(plan.get('steps'), plan.get('name', 'plan'))
+
+
+def plan_digest(plan):
+    return hashlib.sha1(json.dumps(plan, sort_keys=True).encode()).hexdigest()
+
+
+class Campaign:
+    def __init__(self, plan, engine, checkpoint_path=None, operator=None, on_step=None):
+        self.plan = plan
+        self.engine = engine
+        self.checkpoint_path = checkpoint_path or f"{plan.get('name', 'campaign')}.checkpoint.json"
+        # operator(message) blocks until the operator confirms; on_step(step, status, result) reports progress
+        self.operator = operator or (lambda message: input(f"{message} [Enter to continue] "))
+        self.on_step = on_step
+        self.cancelled = threading.Event()
+        self.state = None
+        self._lock = threading.Lock()
+
+    def load_checkpoint(self):
+        # A checkpoint from a different version of the plan is ignored rather than half-applied
+        try:
+            with open(self.checkpoint_path) as handle:
+                state = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        return state if state.get('digest') == plan_digest(self.plan) else None
+
+    def save_checkpoint(self):
+        # Write-then-rename so a crash mid-write leaves the previous checkpoint intact
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as handle:
+            json.dump(self.state, handle, indent=2)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    def run(self, resume=True):
+        self.cancelled.clear()
+        self.state = (self.load_checkpoint() if resume else None) or {
+            'plan': self.plan.get('name'),
+            'digest': plan_digest(self.plan),
+            'band': self.plan.get('band'),
+            'completed': {},
+        }
+        self.state['status'] = 'running'
+        try:
+            for step in self.plan['steps']:
+                if self.cancelled.is_set():
+                    self.state['status'] = 'cancelled'
+                    break
+                self.run_step(step)
+                if self.hard_failed(step):
+                    # The verdict is already FAIL; the rest of the plan (e.g. the other band) can't change it
+                    self.state['status'] = 'finished'
+                    self.state['aborted_by'] = step['id']
+                    break
+            else:
+                self.state['status'] = 'finished'
+        except StepError as e:
+            self.state['status'] = 'cancelled' if self.cancelled.is_set() else 'error'
+            self.state['error'] = str(e)
+        except Exception as e:
+            # Not a verdict but a fault (the results store or a checkpoint write failing): still end as an error,
+            # so nothing waiting on the state sees a campaign that is forever running
+            self.state['status'] = 'error'
+            self.state['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            with self._lock:
+                # A finished campaign has nothing left to resume; its runs are in the results store
+                if self.state['status'] == 'finished':
+                    self.clear_checkpoint()
+                else:
+                    self.save_checkpoint()
+        return self.state
+
+    def cancel(self):
+        self.cancelled.set()
+        self.engine.cancel()
+
+    def results(self):
+        # Completed step results in plan order, parallel children flattened
+        def walk(steps):
+            for step in steps:
+                if step['type'] == 'parallel':
+                    yield from walk(step['steps'])
+                elif step['id'] in self.state['completed']:
+                    yield step, self.state['completed'][step['id']]
+        return list(walk(self.plan['steps']))
+
+    def hard_failed(self, step):
+        steps = step['steps'] if step['type'] == 'parallel' else [step]
+        return any(self.state['completed'].get(child['id'], {}).get('hard_failures') for child in steps)
+
+    def passed(self):
+        return self.state['status'] == 'finished' and all(result.get('passed', True) for _, result in self.results())
+
+    def run_step(self, step):
+        if step['id'] in self.state['completed']:
+            self._report(step, 'skipped', self.state['completed'][step['id']])
+            return
+        self._report(step, 'started', None)
+        if step['type'] == 'parallel':
+            self.run_parallel(step)
+            return
+
+        result = getattr(self, f"step_{step['type']}")(step)
+        result['finished_at'] = time.time()
+        with self._lock:
+            self.state['completed'][step['id']] = result
+            self.save_checkpoint()
+        self._report(step, 'finished', result)
+
+    def run_parallel(self, step):
+        # Children only share the checkpoint; each is saved as it finishes so a rerun skips it
+        with ThreadPoolExecutor(max_workers=len(step['steps'])) as pool:
+            futures = [pool.submit(self.run_step, child) for child in step['steps']]
+            errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        result = {'passed': True, 'finished_at': time.time()}
+        with self._lock:
+            self.state['completed'][step['id']] = result
+            self.save_checkpoint()
+        self._report(step, 'finished', result)
+
+    def _report(self, step, status, result):
+        if self.on_step is not None:
+            self.on_step(step, status, result)
+
+    def step_band_switch(self, step):
+        self.operator(step.get('message', f"Switch the access point to {step['band']}"))
+        if self.cancelled.is_set():
+            raise StepError("cancelled while waiting for the operator")
+        with self._lock:
+            self.state['band'] = step['band']
+        return {'band': step['band']}
+
+    def step_wait_operator(self, step):
+        self.operator(step.get('message', "Continue?"))
+        if self.cancelled.is_set():
+            raise StepError("cancelled while waiting for the operator")
+        return {}
+
+    def step_rssi(self, step):
+        interface = self.engine.wifi.wireless_interface()
+        if interface is None:
+            raise StepError("no wireless interface found")
+        sampler = WifiSampler(self.engine.wifi, interface, interval=step.get('interval', 1))
+        sampler.run(self._deadline(step.get('seconds', CONST_RSSI_SECONDS)))
+        if self.cancelled.is_set():
+            raise StepError("cancelled during the RSSI check")
+        stats = sampler.stats()
+        if stats['signal_dBm'] is None:
+            raise StepError(f"no signal readings from {interface}")
+        threshold = step.get('min_dBm', CONST_ACCEPTED_RSSI)
+        return dict(stats, band=self.state['band'], interface=interface, min_dBm=threshold,
+                    passed=stats['signal_dBm'] >= threshold)
+
+    def step_health(self, step):
+        engine = self.engine
+        monitor = LivenessMonitor(step.get('server', engine.server), port=step.get('port', engine.port),
+                                  method=step.get('probe', engine.probe), supervisor=engine.supervisor)
+        monitor.run(self._deadline(step.get('seconds', CONST_HEALTH_SECONDS)))
+        if self.cancelled.is_set():
+            raise StepError("cancelled during the health check")
+        return dict(monitor.stats(), server=monitor.server, passed=not monitor.server_down)
+
+    def step_bandwidth(self, step):
+        engine = self.engine
+        saved = engine.duration, engine.band, engine.rssi, engine.convergence
+        engine.duration = int(step.get('minutes', 0) * 60 + step.get('seconds', 0)) or engine.duration
+        engine.band = self.state['band']
+        engine.rssi = None
+        # "adaptive": true or ConvergenceDetector arguments; the step's duration becomes the cap
+        adaptive = step.get('adaptive')
+        engine.convergence = {} if adaptive is True else adaptive or None
+        try:
+            engine.run_tests()
+            if engine.cancelled or self.cancelled.is_set():
+                raise StepError("bandwidth test cancelled")
+            if engine.server_down():
+                # The test server or the path to it failed, not the DUT: rerun the step on resume
+                raise StepError(f"server {engine.server} stopped answering during the bandwidth test")
+            if engine.is_test_bandwidth_fail():
+                raise StepError("bandwidth test produced no usable result")
+            summary = engine.summary()
+        finally:
+            engine.duration, engine.band, engine.rssi, engine.convergence = saved
+        result = {key: summary[key] for key in ('run_id', 'band', 'rssi', 'duration', 'average_upload_Mbps',
+                                                'average_download_Mbps', 'rule_failures', 'converged', 'passed')}
+        # Failing a hard rule ends the campaign, see run()
+        result['hard_failures'] = stats.evaluate([stats.parse_rule(rule) for rule in step.get('hard_rules', [])],
+                                                 summary['statistics'])
+        result['passed'] = result['passed'] and not result['hard_failures']
+        if 'min_dBm' in step:
+            # The signal the link held under load, averaged over the whole run, not an idle read before it
+            if summary['rssi'] is None:
+                raise StepError("no signal readings during the bandwidth test")
+            result['min_dBm'] = step['min_dBm']
+            result['rssi_passed'] = summary['rssi'] >= step['min_dBm']
+            result['passed'] = result['passed'] and result['rssi_passed']
+        return result
+
+    def _deadline(self, seconds):
+        # A stop event that fires after `seconds`, or at once if the campaign is cancelled
+        stop_event = threading.Event()
+        timer = threading.Timer(seconds, stop_event.set)
+        timer.daemon = True
+        timer.start()
+        threading.Thread(target=lambda: self.cancelled.wait(seconds) and stop_event.set(), daemon=True).start()
+        return stop_event
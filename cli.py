@@ -0,0 +1,336 @@
+import argparse
+import csv
+import json
+import sys
+import time
+
+from campaign import Campaign, load_plan
+from engine import BandwidthEngine, CONST_CEILING_MARGIN, CONST_DEFAULT_SERVER, CONST_DEFAULT_PORT
+from fanout import FanOut, parse_targets
+import adaptive
+import instrumentation
+import iperf_client
+import local_server
+import scheduler
+import stats
+from store import ResultStore, CONST_DEFAULT_DB
+import tuning
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description="Run an iperf3 bandwidth test without the GUI")
+    parser.add_argument('--server', default=CONST_DEFAULT_SERVER)
+    parser.add_argument('--port', type=int, default=CONST_DEFAULT_PORT)
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--stream', type=int, default=10)
+    parser.add_argument('--window', help="TCP window / socket buffer per stream, e.g. 512K (default: kernel's)")
+    parser.add_argument('--tune', action='store_true',
+                        help="pick --stream and --window from a short sweep, cached per server and band")
+    parser.add_argument('--retune', action='store_true', help="with --tune, sweep again even if a choice is cached")
+    parser.add_argument('--tune-streams', type=_int_list, default=tuning.CONST_STREAMS,
+                        help="stream counts to sweep (default: 1,2,4,8,16,32)")
+    parser.add_argument('--tune-windows', type=_window_list, default=tuning.CONST_WINDOWS,
+                        help="windows to sweep, 'default' for the kernel's (default: default,512K,2M)")
+    parser.add_argument('--mode', choices=scheduler.CONST_MODES, default='sequential')
+    parser.add_argument('--order', type=_order, default=','.join(scheduler.CONST_DIRECTIONS),
+                        help="comma separated direction order, e.g. download,upload; one direction tests only that")
+    parser.add_argument('--servers', help="fan out over many targets, e.g. host1:5201-5210,host2:5201 (with "
+                                          "--mode concurrent, each target takes one consecutive port per direction)")
+    parser.add_argument('--workers', type=int, help="concurrent targets when fanning out (default: 4, or "
+                                                     "64 with --async)")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="run clients and probes as asyncio tasks instead of one thread each")
+    parser.add_argument('--timeout', type=int, help="per-run timeout in seconds (default: duration + 10)")
+    parser.add_argument('--retries', type=int, default=3, help="attempts per target while the server is busy")
+    parser.add_argument('--band', help="band label stored with the run, e.g. 2.4Ghz or 5.0Ghz")
+    parser.add_argument('--rule', dest='rules', action='append', type=stats.parse_rule,
+                        help="pass rule on interval statistics, e.g. download.p5>=50 (repeatable; "
+                             "default: the band's rules)")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="stop each direction once its mean has converged; --duration becomes the cap")
+    parser.add_argument('--tolerance', type=float, default=adaptive.CONST_TOLERANCE,
+                        help="with --adaptive, the 95%% confidence half-width as a share of the mean "
+                             "(default: %(default)s)")
+    parser.add_argument('--warmup', type=int, default=adaptive.CONST_WARMUP,
+                        help="with --adaptive, intervals ignored at the start (default: %(default)s)")
+    parser.add_argument('--db', default=CONST_DEFAULT_DB, help="results database (default: %(default)s)")
+    parser.add_argument('--no-store', action='store_true', help="don't save the run to the results database")
+    parser.add_argument('--history', action='store_true', help="list stored runs instead of running a test")
+    parser.add_argument('--days', type=float, help="with --history, only runs from the last N days")
+    parser.add_argument('--stats', action='store_true',
+                        help="with --history, add p5/p50/p95 and outlier counts for every listed run")
+    parser.add_argument('--export', dest='export_path',
+                        help="with --history, export the matching runs' samples to .xlsx, .csv or .parquet")
+    parser.add_argument('--campaign', help="run a test plan (.json, or .yaml with PyYAML), resuming from its checkpoint")
+    parser.add_argument('--restart', action='store_true', help="with --campaign, ignore any saved checkpoint")
+    parser.add_argument('--self-test', action='store_true',
+                        help="measure this host's loopback ceiling first and flag results close to it")
+    parser.add_argument('--local', action='store_true', help="test against a local iperf3 server pool on loopback")
+    parser.add_argument('--serve', action='store_true',
+                        help="run the local iperf3 server pool on all interfaces until interrupted, for LAN tests")
+    parser.add_argument('--local-ports', type=_port_range, default=local_server.CONST_PORTS,
+                        help="ports for the local server pool (default: 5301-5304)")
+    parser.add_argument('--json', dest='json_path', help="write the run summary as JSON")
+    parser.add_argument('--csv', dest='csv_path', help="write per-interval upload/download as CSV")
+    parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help="console log level (default: %(default)s)")
+    parser.add_argument('--log-json', help="also write a JSON-lines log, including every phase timing, to this file")
+    parser.add_argument('--metrics-port', type=int,
+                        help="serve phase timings and counters in Prometheus text format on this port")
+    parser.add_argument('--metrics-json', help="write phase timings and counters as JSON when the run ends")
+    parser.add_argument('--profile', help="write cProfile stats for the run to this file (open with pstats/snakeviz)")
+    parser.add_argument('--tracemalloc', action='store_true', help="log peak memory and the top allocation sites")
+    return parser
+
+
+def _int_list(spec):
+    return [int(item) for item in spec.split(',')]
+
+
+def _window_list(spec):
+    windows = [None if item.strip() == 'default' else item.strip() for item in spec.split(',')]
+    for window in windows:
+        iperf_client.window_bytes(window)
+    return windows
+
+
+def _order(spec):
+    try:
+        return scheduler.check_order(item.strip() for item in spec.split(',') if item.strip())
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _port_range(spec):
+    first, _, last = spec.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+def _convergence(args):
+    return {'tolerance': args.tolerance, 'warmup': args.warmup} if args.adaptive else None
+
+
+def _mbps(value):
+    return '-' if value is None else f"{value:.2f}"
+
+
+def write_table_csv(path, rows):
+    columns = ['server', 'port', 'stream', 'window', 'average_upload_Mbps', 'average_download_Mbps', 'intervals',
+               'attempts', 'busy', 'passed', 'elapsed']
+    with open(path, 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def show_history(args, store):
+    server = args.server if args.server != CONST_DEFAULT_SERVER else None
+    since = time.time() - args.days * 86400 if args.days else None
+    runs = store.query_runs(server=server, band=args.band, since=since)
+
+    if args.export_path:
+        import export
+        with instrumentation.span('export', format=args.export_path.rsplit('.', 1)[-1]):
+            export.export_runs(store, [run['run_id'] for run in runs], args.export_path)
+
+    if args.stats:
+        report = stats.summarize_runs(store, [run['run_id'] for run in runs])
+        for run in runs:
+            run['statistics'] = report[run['run_id']]
+
+    if args.json_path:
+        with open(args.json_path, 'w') as handle:
+            json.dump(runs, handle, indent=2)
+    for run in runs:
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['started_at']))
+        print(f"{run['run_id']}  {started}  {run['server']}:{run['port']}  {run['band'] or '-'}  "
+              f"upload {_mbps(run['average_upload_Mbps'])}  download {_mbps(run['average_download_Mbps'])}  "
+              f"{'PASS' if run['passed'] else 'FAIL'}")
+        if args.stats:
+            for direction, summary in run['statistics'].items():
+                if summary['count']:
+                    print(f"    {direction}: p5 {summary['p5']:.1f}  p50 {summary['p50']:.1f}  "
+                          f"p95 {summary['p95']:.1f}  cv {summary['cv'] or 0:.2f}  outliers {summary['outliers']}")
+    return 0
+
+
+def _engine_class(args):
+    if args.use_async:
+        # asyncio alone costs ~50 ms to import, so only --async runs pay for it
+        from async_engine import AsyncBandwidthEngine
+        return AsyncBandwidthEngine
+    return BandwidthEngine
+
+
+def _tuner(args, engine_class):
+    return tuning.StreamTuner(streams=args.tune_streams, windows=args.tune_windows, cache=tuning.TuningCache(),
+                              engine_class=engine_class, timeout=args.timeout)
+
+
+def _print_choice(choice, server=None):
+    prefix = f"{server}: " if server else ''
+    if choice is None:
+        print(f"{prefix}Tuning produced no result; keeping --stream/--window")
+    else:
+        print(f"{prefix}Tuned: -P {choice['stream']} -w {choice['window'] or 'default'} "
+              f"({_mbps(choice['Mbps'])} of {_mbps(choice['peak_Mbps'])} Mbps peak)")
+
+
+def run_fanout(args, store):
+    if args.use_async:
+        from async_engine import AsyncFanOut, CONST_MAX_CONCURRENCY
+        fanout_class, workers = AsyncFanOut, CONST_MAX_CONCURRENCY
+    else:
+        fanout_class, workers = FanOut, 4
+    targets = parse_targets(args.servers, default_port=args.port)
+    tuned = None
+    if args.tune:
+        # One sweep per server, the sweeps of different servers in parallel; all of a server's ports share it
+        tuned = _tuner(args, _engine_class(args)).sweep_many(targets, band=args.band, retune=args.retune)
+        for server, choice in tuned.items():
+            _print_choice(choice, server)
+        tuned = {server: choice for server, choice in tuned.items() if choice is not None}
+    fanout = fanout_class(targets, duration=args.duration, stream=args.stream, window=args.window, tuned=tuned,
+                          mode=args.mode, order=args.order, convergence=_convergence(args), band=args.band,
+                          timeout=args.timeout, retries=args.retries, max_workers=args.workers or workers, store=store,
+                          rules=args.rules)
+    rows = fanout.run()
+    best = FanOut.best(rows)
+    aggregate = FanOut.aggregate(rows)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as handle:
+            json.dump({'targets': rows, 'best': best, 'aggregate': aggregate}, handle, indent=2)
+    if args.csv_path:
+        write_table_csv(args.csv_path, rows)
+
+    for row in rows:
+        print(f"{row['server']}:{row['port']}  upload {_mbps(row['average_upload_Mbps'])}  "
+              f"download {_mbps(row['average_download_Mbps'])}  {'PASS' if row['passed'] else 'FAIL'}")
+    if best is not None:
+        print(f"Best: {best['server']}:{best['port']}")
+    return 0 if aggregate['passed'] else 1
+
+
+def run_campaign(args, store):
+    engine_class = _engine_class(args)
+    engine = engine_class(server=args.server, port=args.port, duration=args.duration, stream=args.stream,
+                          mode=args.mode, order=args.order, timeout=args.timeout, store=store,
+                          rules=args.rules, window=args.window)
+
+    def on_step(step, status, result):
+        if status == 'skipped':
+            print(f"{step['id']}: done in a previous run")
+        elif status == 'finished' and step['type'] != 'parallel':
+            verdict = '' if 'passed' not in result else ' PASS' if result['passed'] else ' FAIL'
+            print(f"{step['id']}: finished{verdict}")
+        elif status == 'started':
+            print(f"{step['id']}: {step['type']} ...")
+
+    campaign = Campaign(load_plan(args.campaign), engine, on_step=on_step)
+    state = campaign.run(resume=not args.restart)
+    if args.json_path:
+        with open(args.json_path, 'w') as handle:
+            json.dump(state, handle, indent=2)
+    if state['status'] != 'finished':
+        print(f"{state['status']}: {state.get('error', '')} (checkpoint: {campaign.checkpoint_path})")
+    elif state.get('aborted_by'):
+        print(f"{state['aborted_by']} failed a hard rule; the remaining steps were skipped")
+    print("PASS" if campaign.passed() else "FAIL")
+    return 0 if campaign.passed() else 1
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.tune and args.campaign:
+        # A campaign switches bands between steps, and a tuning choice only holds for the band it was swept on
+        parser.error("--tune does not apply to --campaign; tune each band first with --tune --band")
+    if args.servers and (args.self_test or args.local):
+        # Both test against this host's loopback pool, which has nothing to do with the fanned-out servers
+        parser.error("--self-test and --local do not apply to --servers")
+    instrumentation.configure_logging(args.log_level, args.log_json)
+    if args.metrics_port is not None:
+        instrumentation.serve_metrics(args.metrics_port)
+    try:
+        with instrumentation.profiling(args.profile, args.tracemalloc):
+            return run(args)
+    finally:
+        if args.metrics_json:
+            instrumentation.metrics.write_json(args.metrics_json)
+
+
+def serve_local(args):
+    with local_server.ServerPool(ports=args.local_ports, bind=None) as pool:
+        print(f"iperf3 servers listening on ports {', '.join(map(str, sorted(pool.servers)))}; Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def run(args):
+    if args.serve:
+        return serve_local(args)
+    store = None if args.no_store and not args.history else ResultStore(args.db)
+    if args.history:
+        return show_history(args, store)
+    if args.servers:
+        return run_fanout(args, store)
+    if args.campaign:
+        return run_campaign(args, store)
+
+    engine_class = _engine_class(args)
+    engine = engine_class(server=args.server, port=args.port, duration=args.duration, stream=args.stream,
+                          mode=args.mode, order=args.order, timeout=args.timeout, store=store,
+                          rules=args.rules, convergence=_convergence(args), window=args.window)
+    engine.band = args.band
+    if args.tune:
+        choice = _tuner(args, engine_class).tuned(args.server, args.port, band=args.band, retune=args.retune)
+        _print_choice(choice)
+        if choice is not None:
+            engine.stream, engine.window = choice['stream'], choice['window']
+    pool = local_server.ServerPool(ports=args.local_ports) if args.self_test or args.local else None
+    try:
+        if pool is not None:
+            pool.start()
+        if args.self_test:
+            engine.ceiling = local_server.self_test(pool, stream=args.stream, mode=args.mode, engine_class=engine_class)
+            print(f"Host ceiling: upload {_mbps(engine.ceiling['upload_Mbps'])}  "
+                  f"download {_mbps(engine.ceiling['download_Mbps'])} Mbps")
+        if args.local:
+            with pool.lease(len(engine.test_targets()[0][1])) as ports:
+                engine.server, engine.port = local_server.CONST_LOOPBACK, ports[0]
+                engine.run_tests()
+        else:
+            engine.run_tests()
+    finally:
+        if pool is not None:
+            pool.stop()
+    summary = engine.summary()
+
+    if args.json_path:
+        with open(args.json_path, 'w') as handle:
+            json.dump(summary, handle, indent=2)
+    if args.csv_path:
+        # export pulls in openpyxl, so only pay for it when writing files
+        import export
+        with instrumentation.span('export', format='csv'):
+            export.export_run_csv(args.csv_path, engine.upl, engine.dowl)
+
+    print(f"Upload: {_mbps(summary['average_upload_Mbps'])} Mbps")
+    print(f"Download: {_mbps(summary['average_download_Mbps'])} Mbps")
+    for direction, interval in (summary['converged'] or {}).items():
+        print(f"{direction} converged after {interval} intervals")
+    for failure in summary['rule_failures']:
+        print(f"rule failed: {failure}")
+    for direction in summary['host_limited']:
+        print(f"{direction}: within {CONST_CEILING_MARGIN:.0%} of this host's ceiling, the tester may be the limit")
+    print("PASS" if summary['passed'] else "FAIL")
+    return 0 if summary['passed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+import logging
+import subprocess
+import threading
+import time
+
+import adaptive
+import instrumentation
+import iperf_client
+from liveness import LivenessMonitor
+import samples
+import scheduler
+import stats
+from supervisor import ProcessSupervisor
+from wifi import WifiSampler, WifiTelemetry
+
+
+CONST_DEFAULT_SERVER = '89.187.160.1'
+CONST_DEFAULT_PORT = 5201
+# A result at or above this share of the host's loopback ceiling may be the tester's limit, not the DUT's
+CONST_CEILING_MARGIN = 0.9
+# What iperf3 reports when its client is interrupted, as it is on an early stop
+CONST_INTERRUPT_ERROR = 'the client has terminated'
+
+log = logging.getLogger(__name__)
+
+
+class BandwidthEngine:
+    def __init__(self, server=CONST_DEFAULT_SERVER, port=CONST_DEFAULT_PORT, duration=10, iterations=1, stream=10,
+                 mode='sequential', order=scheduler.CONST_DIRECTIONS, timeout=None, probe='ping', supervisor=None,
+                 store=None, wifi=None, rules=None, gap=scheduler.CONST_GAP, convergence=None, window=None,
+                 on_result=None, on_error=None):
+        self.upl = []
+        self.dowl = []
+        self.error_cnt = 0
+        self.server = server
+        self.port = port
+        self.duration = duration
+        self.iterations = iterations
+        self.stream = stream
+        self.window = window
+        self.mode = mode
+        self.order = scheduler.check_order(order)
+        self.gap = gap
+        self.timeout = timeout
+        self.probe = probe
+        self.rules = rules
+        # ConvergenceDetector arguments; when set, duration is only the cap and a direction stops once it converges
+        self.convergence = convergence
+        # direction -> interval at which it converged and was stopped
+        self.converged = {}
+        self.liveness = {}
+        self.test_results = []
+        self.samples = samples.SampleBuffer()
+        self.supervisor = supervisor or ProcessSupervisor()
+        self.stop_event = None
+        self.cancelled = False
+        self.store = store
+        self.run_id = None
+        self.started_at = None
+        self.band = None
+        self.rssi = None
+        self.wifi = wifi or WifiTelemetry()
+        self.wifi_sampler = None
+        # Loopback self-test result ({'upload_Mbps': ..., 'download_Mbps': ...}), see local_server.self_test
+        self.ceiling = None
+        self.on_result = on_result
+        self.on_error = on_error
+
+    def run_iperf3_test(self, reverse, stop_event, server=None, port=None, bidir=False):
+        if stop_event.is_set():
+            return
+
+        json_stream = iperf_client.supports_json_stream(self.supervisor)
+        command = iperf_client.build_command(server or self.server, port or self.port, self.duration, self.stream,
+                                             reverse=reverse, json_stream=json_stream, bidir=bidir,
+                                             window=self.window)
+        parser = iperf_client.IntervalParser(json_stream, self.stream, buffer=self.samples,
+                                             direction=samples.CONST_DOWNLOAD if reverse else samples.CONST_UPLOAD)
+        direction = 'bidir' if bidir else 'download' if reverse else 'upload'
+        detectors = self.convergence_detectors(bidir)
+
+        try:
+            with instrumentation.span('spawn', program='iperf3'):
+                process = self.supervisor.spawn(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                                bufsize=1)
+        except OSError as e:
+            log.error("could not start iperf3: %s", e)
+            self.report_result({'error': str(e)})
+            return
+
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self.abort_iperf3_test, args=(process,))
+            timer.start()
+        # A dead server can leave iperf3 silent, so a stop signals the process rather than waiting for its next line
+        self.supervisor.watch(process, stop_event)
+
+        # Intervals are handed over as iperf3 flushes them, so nothing is held back until -t expires.
+        # After a stop keep reading to EOF: iperf3 flushes what it measured so far on SIGINT.
+        # Time blocked on iperf3 and time spent parsing are summed separately, once per process, so the
+        # per-line cost stays two perf_counter calls.
+        waited = parsed = 0.0
+        mark = time.perf_counter()
+        for line in process.stdout:
+            read_at = time.perf_counter()
+            event = parser.parse_line(line)
+            waited += read_at - mark
+            mark = time.perf_counter()
+            parsed += mark - read_at
+            if event is not None:
+                self.handle_event(event, reverse, direction)
+                if self.check_convergence(detectors, event, direction):
+                    self.supervisor.stop(process)
+
+        if timer is not None:
+            timer.cancel()
+        process.stdout.close()
+        process.wait()
+        self.supervisor.release(process)
+        instrumentation.observe('iperf3_wait', waited, direction=direction)
+        instrumentation.observe('parse', parsed, direction=direction)
+        if parser.errors:
+            instrumentation.count('parse_errors', parser.errors, direction=direction)
+
+    def handle_event(self, event, reverse, direction):
+        if event['event'] == 'interval':
+            # The parser already stored the interval; this only feeds live listeners
+            if self.on_result is None:
+                return
+            if 'bits_per_second' in event:
+                self.on_result({'received_Mbps' if reverse else 'sent_Mbps': event['bits_per_second'] / 1e6,
+                                'time': time.time()})
+            if 'reverse_bits_per_second' in event:
+                self.on_result({'received_Mbps': event['reverse_bits_per_second'] / 1e6, 'time': time.time()})
+        elif event['event'] == 'error':
+            if direction in self.converged and CONST_INTERRUPT_ERROR in event['error']:
+                return
+            log.warning("iperf3 %s: %s", direction, event['error'])
+            instrumentation.count('iperf3_errors', direction=direction)
+            self.report_result({'error': event['error']})
+            if self.on_error is not None:
+                self.on_error(event['error'])
+        elif event['event'] == 'end' and event.get('summary'):
+            self.report_result({'end': event['summary'], 'direction': 'download' if reverse else 'upload'})
+
+    def convergence_detectors(self, bidir):
+        if self.convergence is None:
+            return None
+        return [adaptive.ConvergenceDetector(**self.convergence) for _ in range(2 if bidir else 1)]
+
+    def check_convergence(self, detectors, event, direction):
+        # True once, on the interval where every direction of this client has converged
+        if detectors is None or event['event'] != 'interval' or direction in self.converged:
+            return False
+        values = (event.get('bits_per_second'), event.get('reverse_bits_per_second'))
+        for detector, value in zip(detectors, values):
+            if value is not None:
+                detector.add(value / 1e6)
+        if not all(detector.converged for detector in detectors):
+            return False
+        self.converged[direction] = max(detector.converged_at for detector in detectors)
+        log.info("%s converged after %d intervals", direction, self.converged[direction])
+        instrumentation.count('converged', direction=direction)
+        return True
+
+    def abort_iperf3_test(self, process):
+        if process.poll() is None:
+            log.warning("iperf3 run timed out after %ss", self.timeout)
+            instrumentation.count('iperf3_errors', direction='timeout')
+            self.report_result({'error': f"iperf3 run timed out after {self.timeout}s"})
+            self.supervisor.stop(process)
+
+    def cancel(self):
+        self.cancelled = True
+        if self.stop_event is not None:
+            self.stop_event.set()
+        self.supervisor.cancel()
+
+    def report_result(self, result):
+        self.test_results.append(result)
+        if self.on_result is not None:
+            self.on_result(result)
+
+    def check_server_status(self, stop_event, server=None):
+        server = server or self.server
+        monitor = LivenessMonitor(server, port=self.port, method=self.probe, supervisor=self.supervisor)
+        self.liveness[server] = monitor
+        monitor.run(stop_event)
+        if monitor.server_down:
+            self.report_result({'server_status': 'down'})
+
+    def test_targets(self):
+        # Concurrent clients cannot share one iperf3 server port, so give each direction its own
+        ports = range(self.port, self.port + len(self.order)) if self.mode == 'concurrent' else [self.port]
+        return [(self.server, ports)]
+
+    def run_direction(self, direction, stop_event, server, port):
+        self.run_iperf3_test(direction == 'download', stop_event, server=server, port=port, bidir=direction == 'bidir')
+
+    def run_tests(self):
+        self.clear_test_results()
+        self.cancelled = False
+        self.run_id = None
+        self.started_at = time.time()
+        self.stop_event = threading.Event()
+        self.start_wifi_sampling(self.stop_event)
+        test_scheduler = scheduler.TestScheduler(self.run_direction, self.test_targets(),
+                                                 monitor=self.check_server_status, mode=self.mode, order=self.order,
+                                                 gap=self.gap)
+        test_scheduler.run(self.stop_event)
+        wifi_stats = self.wifi_sampler.stats() if self.wifi_sampler is not None else None
+        if wifi_stats and wifi_stats['signal_dBm'] is not None:
+            # The run's RSSI is what the link saw while loaded, not a single read before it
+            self.rssi = round(wifi_stats['signal_dBm'])
+        with instrumentation.span('process_results'):
+            self.process_test_results()
+        if self.store is not None:
+            with instrumentation.span('store'):
+                self.run_id = self.store.save_run(self.summary(), self.interval_samples(), band=self.band,
+                                                  rssi=self.rssi, started_at=self.started_at)
+
+    def start_wifi_sampling(self, stop_event):
+        self.wifi_sampler = None
+        interface = self.wifi.wireless_interface()
+        if interface is None:
+            return
+        self.wifi_sampler = WifiSampler(self.wifi, interface)
+        threading.Thread(target=self.wifi_sampler.run, args=(stop_event,), daemon=True).start()
+
+    def interval_samples(self):
+        for timestamp, direction, mbps in self.samples.rows():
+            yield timestamp, samples.CONST_DIRECTION_NAMES[direction], mbps
+
+    @staticmethod
+    def average_bandwidth(upl, dowl):
+        # None for a direction with no intervals, e.g. one the order left out
+        average_upl = sum(upl) / len(upl) if len(upl) else None
+        average_dowl = sum(dowl) / len(dowl) if len(dowl) else None
+        return average_upl, average_dowl
+
+    def clear_test_results(self):
+        self.test_results.clear()
+        self.samples.clear()
+        self.upl.clear()
+        self.dowl.clear()
+        self.liveness = {}
+        self.converged = {}
+        self.error_cnt = 0
+
+    def process_test_results(self):
+        self.upl = self.samples.series(samples.CONST_UPLOAD)
+        self.dowl = self.samples.series(samples.CONST_DOWNLOAD)
+        for result in self.test_results:
+            if 'server_status' in result:
+                if result['server_status'] == 'down':
+                    log.warning("server %s is down", self.server)
+            elif 'error' in result:
+                self.error_cnt += 1
+        if self.error_cnt:
+            log.warning("%d iperf3 errors in this run", self.error_cnt)
+
+    def server_down(self):
+        return any(monitor.server_down for monitor in self.liveness.values())
+
+    def is_test_bandwidth_fail(self):
+        # Only the directions this run was scheduled to test need results
+        results = {'upload': self.upl, 'download': self.dowl}
+        directions = scheduler.CONST_DIRECTIONS if self.mode == 'bidir' else self.order
+        return (self.error_cnt >= self.duration/5) or any(len(results[direction]) == 0 for direction in directions)
+
+    def host_limited(self, average_upl, average_dowl):
+        # Directions that came within CONST_CEILING_MARGIN of what this host can push over loopback
+        if self.ceiling is None:
+            return []
+        averages = {'upload': average_upl, 'download': average_dowl}
+        return [direction for direction, average in averages.items()
+                if average is not None and average >= CONST_CEILING_MARGIN * self.ceiling[f'{direction}_Mbps']]
+
+    def pass_rules(self):
+        # Explicit rules win; otherwise the band's defaults, if the run was labelled with one
+        return self.rules if self.rules is not None else stats.CONST_BAND_RULES.get(self.band, [])
+
+    def rule_failures(self, run_stats=None):
+        return stats.evaluate(self.pass_rules(), run_stats or stats.run_stats(self.upl, self.dowl))
+
+    def summary(self):
+        average_upl, average_dowl = self.average_bandwidth(upl=self.upl, dowl=self.dowl)
+        run_stats = stats.run_stats(self.upl, self.dowl)
+        rule_failures = self.rule_failures(run_stats)
+        return {
+            'run_id': self.run_id,
+            'band': self.band,
+            'rssi': self.rssi,
+            'server': self.server,
+            'port': self.port,
+            'stream': self.stream,
+            'window': self.window,
+            'duration': self.duration,
+            'mode': self.mode,
+            'upload_Mbps': self.upl,
+            'download_Mbps': self.dowl,
+            'average_upload_Mbps': average_upl,
+            'average_download_Mbps': average_dowl,
+            'statistics': run_stats,
+            'retransmits': {name: self.samples.retransmits(direction)
+                            for direction, name in enumerate(samples.CONST_DIRECTION_NAMES)},
+            'rule_failures': rule_failures,
+            'host_ceiling': self.ceiling,
+            'host_limited': self.host_limited(average_upl, average_dowl),
+            'converged': dict(self.converged) if self.convergence is not None else None,
+            'errors': [result['error'] for result in self.test_results if 'error' in result],
+            # iperf3's own end-of-test totals and CPU use, one per client process
+            'iperf3_end': [dict(result['end'], direction=result['direction'])
+                           for result in self.test_results if 'end' in result],
+            'liveness': {server: dict(monitor.stats(), samples=monitor.samples)
+                         for server, monitor in self.liveness.items()},
+            'wifi': (dict(self.wifi_sampler.stats(), samples=self.wifi_sampler.samples)
+                     if self.wifi_sampler is not None else None),
+            'server_down': self.server_down(),
+            'cancelled': self.cancelled,
+            # A run cut short, by the liveness monitor or a cancel, is never a pass however good its first intervals
+            'passed': (not self.is_test_bandwidth_fail() and not rule_failures and not self.server_down()
+                       and not self.cancelled),
+        }
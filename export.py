@@ -0,0 +1,124 @@
+import csv
+import itertools
+import os
+
+
+CONST_FORMATS = ('xlsx', 'csv', 'parquet')
+CONST_SAMPLE_COLUMNS = ('run_id', 'started_at', 'server', 'port', 'stream', 'band', 'rssi', 'timestamp', 'direction',
+                        'Mbps')
+CONST_PARQUET_BATCH = 65536
+
+
+def export_format(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in CONST_FORMATS:
+        raise ValueError(f"unsupported export format: {fmt}")
+    return fmt
+
+
+def _run_rows(upl, dowl, average_upl, average_dowl):
+    yield ["Upload (Mbps)", "Download (Mbps)"]
+    # Averages sit in D5:E6 as in the original sheet, so pad short runs out to row 6
+    for index in range(max(len(upl), len(dowl), 5)):
+        row = [upl[index] if index < len(upl) else None, dowl[index] if index < len(dowl) else None]
+        if index == 3:
+            row += [None, "Average Upload: ", average_upl]
+        elif index == 4:
+            row += [None, "Average Download: ", average_dowl]
+        yield row
+
+
+def _openpyxl():
+    # openpyxl and its chart module take ~200 ms to import; CSV/Parquet exports and app startup don't need them
+    import openpyxl
+    import openpyxl.chart
+    return openpyxl
+
+
+def _line_chart(sheet, title, column, rows):
+    openpyxl = _openpyxl()
+    chart = openpyxl.chart.LineChart()
+    chart.title = title
+    chart.x_axis.title = "Times"
+    chart.y_axis.title = "Mbps"
+    values = openpyxl.chart.Reference(sheet, min_col=column, max_col=column, min_row=1, max_row=rows + 1)
+    chart.add_data(values, titles_from_data=True)
+    return chart
+
+
+def export_run_xlsx(path, upl, dowl, average_upl, average_dowl):
+    # Write-only workbooks stream rows to disk instead of keeping a cell object per value
+    wb = _openpyxl().Workbook(write_only=True)
+    sheet = wb.create_sheet("Bandwidth Test Result")
+    for row in _run_rows(upl, dowl, average_upl, average_dowl):
+        sheet.append(row)
+
+    sheet.add_chart(_line_chart(sheet, "Upload Chart", 1, len(upl)), "G2")
+    sheet.add_chart(_line_chart(sheet, "Download Chart", 2, len(dowl)), "G20")
+    wb.save(path)
+
+
+def export_run_csv(path, upl, dowl):
+    with open(path, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['interval', 'upload_Mbps', 'download_Mbps'])
+        for index, (upload, download) in enumerate(itertools.zip_longest(upl, dowl, fillvalue='')):
+            writer.writerow([index, upload, download])
+
+
+def export_runs(store, run_ids, path, fmt=None):
+    fmt = export_format(path, fmt)
+    run_ids = list(run_ids)
+
+    if fmt == 'csv':
+        with open(path, 'w', newline='') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(CONST_SAMPLE_COLUMNS)
+            writer.writerows(store.iter_samples(run_ids))
+    elif fmt == 'xlsx':
+        wb = _openpyxl().Workbook(write_only=True)
+        runs_sheet = wb.create_sheet("Runs")
+        columns = None
+        for run in store.get_runs(run_ids):
+            if columns is None:
+                columns = list(run)
+                runs_sheet.append(columns)
+            runs_sheet.append([run[column] for column in columns])
+
+        # Run details are already on the Runs sheet; repeating them per sample would multiply the cell count
+        samples_sheet = wb.create_sheet("Samples")
+        samples_sheet.append(['run_id', 'timestamp', 'direction', 'Mbps'])
+        for row in store.iter_samples(run_ids, with_runs=False):
+            samples_sheet.append(row)
+        wb.save(path)
+    else:
+        _export_parquet(path, store.iter_samples(run_ids))
+
+
+def _export_parquet(path, samples):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ('run_id', pa.int64()),
+        ('started_at', pa.float64()),
+        ('server', pa.string()),
+        ('port', pa.int32()),
+        ('stream', pa.int32()),
+        ('band', pa.string()),
+        ('rssi', pa.int32()),
+        ('timestamp', pa.float64()),
+        ('direction', pa.string()),
+        ('Mbps', pa.float64()),
+    ])
+    with pq.ParquetWriter(path, schema) as writer:
+        while True:
+            batch = list(itertools.islice(samples, CONST_PARQUET_BATCH))
+            if not batch:
+                break
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays([pa.array(column, type=field.type)
+                                                     for column, field in zip(columns, schema)], schema=schema))
@@ -0,0 +1,161 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import BandwidthEngine, CONST_DEFAULT_PORT
+import scheduler
+from supervisor import ProcessSupervisor
+
+
+CONST_BUSY_ERROR = 'server is busy'
+CONST_TIMEOUT_GRACE = 10
+
+
+def parse_targets(spec, default_port=CONST_DEFAULT_PORT):
+    # "host1:5201-5210, host2:5201, host3" -> [(host1, 5201), ..., (host1, 5210), (host2, 5201), (host3, default)]
+    targets = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        server, _, ports = item.partition(':')
+        if not ports:
+            targets.append((server, default_port))
+            continue
+        first, _, last = ports.partition('-')
+        targets.extend((server, port) for port in range(int(first), int(last or first) + 1))
+    return targets
+
+
+def port_blocks(targets, size):
+    # A concurrent run uses port .. port + size - 1 on its server. Listed ports that fall inside an earlier
+    # target's block become that target's extra ports, so no two clients ever share one iperf3 server port:
+    # "host:5201-5210" -> 5201, 5203, 5205, 5207, 5209
+    blocks = []
+    used = set()
+    for server, port in sorted(dict.fromkeys(targets)):
+        if (server, port) in used:
+            continue
+        used.update((server, block_port) for block_port in range(port, port + size))
+        blocks.append((server, port))
+    return blocks
+
+
+class FanOut:
+    def __init__(self, targets, duration=10, stream=10, mode='sequential', max_workers=4, timeout=None, retries=3,
+                 retry_delay=2, store=None, rules=None, gap=scheduler.CONST_GAP, supervisor=None, window=None,
+                 tuned=None, order=scheduler.CONST_DIRECTIONS, convergence=None, band=None):
+        self.order = tuple(order)
+        if mode == 'concurrent':
+            targets = port_blocks(targets, len(self.order))
+        self.targets = list(targets)
+        self.duration = duration
+        self.stream = stream
+        self.window = window
+        # server -> tuning choice ({'stream': ..., 'window': ...}, see StreamTuner.sweep_many); overrides the above
+        self.tuned = tuned or {}
+        self.mode = mode
+        self.max_workers = max_workers
+        # Per-run cap; iperf3 itself needs a few seconds on top of -t to connect and report
+        self.timeout = timeout or duration + CONST_TIMEOUT_GRACE
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.store = store
+        self.rules = rules
+        self.gap = gap
+        self.convergence = convergence
+        # Stored with every run; with no explicit rules, also picks the band's default ones
+        self.band = band
+        self.rows = []
+        self.supervisor = supervisor or ProcessSupervisor()
+        self.cancelled = threading.Event()
+        self._engines = set()
+        self._lock = threading.Lock()
+
+    def settings(self, server):
+        choice = self.tuned.get(server)
+        if choice is None:
+            return self.stream, self.window
+        return choice['stream'], choice['window']
+
+    def new_engine(self, server, port, engine_class=BandwidthEngine, **kwargs):
+        stream, window = self.settings(server)
+        engine = engine_class(server=server, port=port, duration=self.duration, stream=stream, window=window,
+                              mode=self.mode, order=self.order, timeout=self.timeout, supervisor=self.supervisor,
+                              store=self.store, rules=self.rules, gap=self.gap, convergence=self.convergence,
+                              **kwargs)
+        engine.band = self.band
+        return engine
+
+    def run_target(self, server, port):
+        start_time = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            engine = self.new_engine(server, port)
+            with self._lock:
+                self._engines.add(engine)
+            if not self.cancelled.is_set():
+                engine.run_tests()
+            with self._lock:
+                self._engines.discard(engine)
+            summary = engine.summary()
+            busy = any(CONST_BUSY_ERROR in error for error in summary['errors'])
+            if not busy or attempt >= self.retries or self.cancelled.wait(self.retry_delay * attempt):
+                break
+
+        row = self.make_row(summary, server, port, attempt, busy, start_time)
+        with self._lock:
+            self.rows.append(row)
+        return row
+
+    @staticmethod
+    def make_row(summary, server, port, attempt, busy, start_time):
+        return {
+            'run_id': summary['run_id'],
+            'server': server,
+            'port': port,
+            'stream': summary['stream'],
+            'window': summary['window'],
+            'average_upload_Mbps': summary['average_upload_Mbps'],
+            'average_download_Mbps': summary['average_download_Mbps'],
+            'intervals': len(summary['upload_Mbps']) + len(summary['download_Mbps']),
+            'errors': summary['errors'],
+            'attempts': attempt,
+            'busy': busy,
+            'passed': summary['passed'],
+            'elapsed': round(time.time() - start_time, 1),
+        }
+
+    def run(self):
+        self.rows = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.run_target, server, port) for server, port in self.targets]
+            for future in futures:
+                future.result()
+        self.rows.sort(key=lambda row: (row['server'], row['port']))
+        return self.rows
+
+    def cancel(self):
+        self.cancelled.set()
+        with self._lock:
+            engines = list(self._engines)
+        for engine in engines:
+            engine.cancel()
+
+    @staticmethod
+    def best(rows, key='average_download_Mbps'):
+        passed = [row for row in rows if row['passed']]
+        if not passed:
+            return None
+        return max(passed, key=lambda row: row[key])
+
+    @staticmethod
+    def aggregate(rows):
+        passed = [row for row in rows if row['passed']]
+        return {
+            'targets': len(rows),
+            'passed': len(passed),
+            'total_upload_Mbps': sum(row['average_upload_Mbps'] for row in passed),
+            'total_download_Mbps': sum(row['average_download_Mbps'] for row in passed),
+        }
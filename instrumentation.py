@@ -0,0 +1,176 @@
+import cProfile
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+CONST_PREFIX = 'bandwidth'
+CONST_TRACEMALLOC_TOP = 25
+
+log = logging.getLogger(__name__)
+
+
+class Metrics:
+    def __init__(self):
+        # (name, sorted label items) -> value / [count, total seconds, max seconds]
+        self.counters = {}
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            span = self.spans.setdefault(key, [0, 0.0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+        log.debug('span', extra={'metric': {'span': name, 'seconds': round(seconds, 6), **labels}})
+
+    @contextmanager
+    def span(self, name, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.spans.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'spans': [{'name': name, 'labels': dict(labels), 'count': count, 'seconds': total, 'max_seconds': peak}
+                          for (name, labels), (count, total, peak) in self.spans.items()],
+            }
+
+    def prometheus(self):
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            spans = sorted(self.spans.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f'# TYPE {CONST_PREFIX}_{name}_total counter')
+            lines += [f'{CONST_PREFIX}_{name}_total{_labels(labels)} {value}'
+                      for (counter, labels), value in counters if counter == name]
+        if spans:
+            lines.append(f'# TYPE {CONST_PREFIX}_span_seconds summary')
+            for (name, labels), (count, total, _) in spans:
+                span_labels = _labels((('span', name),) + labels)
+                lines.append(f'{CONST_PREFIX}_span_seconds_count{span_labels} {count}')
+                lines.append(f'{CONST_PREFIX}_span_seconds_sum{span_labels} {total:.6f}')
+            lines.append(f'# TYPE {CONST_PREFIX}_span_max_seconds gauge')
+            lines += [f"{CONST_PREFIX}_span_max_seconds{_labels((('span', name),) + labels)} {peak:.6f}"
+                      for (name, labels), (_, _, peak) in spans]
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        with open(path, 'w') as handle:
+            json.dump(self.snapshot(), handle, indent=2)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+# Process-wide registry: engines, supervisors and the GUI all report here
+metrics = Metrics()
+count = metrics.count
+observe = metrics.observe
+span = metrics.span
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; span/metric records carry their fields under "metric"
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if hasattr(record, 'metric'):
+            entry.update(record.metric)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level='WARNING', json_path=None):
+    handlers = [logging.StreamHandler()]
+    if json_path:
+        handler = logging.FileHandler(json_path)
+        handler.setFormatter(JsonFormatter())
+        handlers.append(handler)
+    logging.basicConfig(level=logging.DEBUG if json_path else level, handlers=handlers,
+                        format='%(levelname)s %(name)s: %(message)s')
+    # The JSON log gets every span; the console keeps to the requested level
+    handlers[0].setLevel(level)
+
+
+def serve_metrics(port, host='127.0.0.1'):
+    # http.server pulls in email/ssl/http.client (~35 ms); only a run that serves metrics pays for it
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = metrics.prometheus().encode(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(metrics.snapshot()).encode(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info("metrics on http://%s:%d/metrics", host, server.server_port)
+    return server
+
+
+@contextmanager
+def profiling(profile_path=None, trace_memory=False):
+    # cProfile only sees the calling thread; the worker threads' phases show up as spans instead
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            log.info("profile written to %s", profile_path)
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            log.warning("tracemalloc: current %.1f MB, peak %.1f MB", current / 1e6, peak / 1e6)
+            for stat in snapshot.statistics('lineno')[:CONST_TRACEMALLOC_TOP]:
+                log.warning("tracemalloc: %s", stat)
@@ -0,0 +1,181 @@
+import re
+import subprocess
+import time
+
+import iperf_parser
+import samples
+
+
+CONST_JSON_STREAM_VERSION = (3, 17)
+CONST_UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9}
+# iperf3 prints byte counts (cwnd) in binary units
+CONST_BYTE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+_TEXT_INTERVAL = re.compile(
+    r'^\[\s*(SUM|\d+)\](?:\[(TX|RX)-C\])?\s+([\d.]+)-([\d.]+)\s+sec\s+[\d.]+\s+\w?Bytes\s+([\d.]+)\s+([KMG]?)bits/sec(.*)$'
+)
+# Sender-side interval lines end with "Retr Cwnd", e.g. "   0    245 KBytes"; [SUM] lines only have Retr
+_TEXT_SENDER = re.compile(r'^\s+(\d+)(?:\s+([\d.]+)\s+([KMG]?)Bytes)?')
+_NAN = float('nan')
+
+# Keyed by the Popen factory, so a replayed iperf3 gets its own answer and the real binary is asked once
+_versions = {}
+
+
+def iperf3_version(supervisor=None):
+    key = supervisor.popen if supervisor is not None else subprocess.Popen
+    if key not in _versions:
+        try:
+            if supervisor is not None:
+                result = supervisor.run(['iperf3', '--version'])
+            else:
+                result = subprocess.run(['iperf3', '--version'], capture_output=True, text=True)
+        except OSError:
+            return None
+        match = re.search(r'iperf (\d+)\.(\d+)', result.stdout)
+        _versions[key] = (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+    return _versions[key]
+
+
+def window_bytes(window):
+    # '512K' -> 524288; None (kernel default) sorts first
+    if not window:
+        return 0
+    match = re.fullmatch(r'([\d.]+)([KMG]?)', str(window).upper())
+    if match is None:
+        raise ValueError(f"invalid window size: {window!r} (expected e.g. 512K or 4M)")
+    return int(float(match.group(1)) * CONST_BYTE_UNITS[match.group(2)])
+
+
+def supports_json_stream(supervisor=None):
+    version = iperf3_version(supervisor)
+    return version is not None and version >= CONST_JSON_STREAM_VERSION
+
+
+def build_command(server, port, duration, stream, reverse=False, json_stream=True, bidir=False, window=None):
+    command = [
+        'iperf3',
+        '-c', server,
+        '-p', str(port),
+        '-t', str(duration),
+        '-P', str(stream),
+    ]
+    if window:
+        # Socket buffer / TCP window per stream, e.g. '512K'; None leaves it to the kernel's autotuning
+        command += ['-w', str(window)]
+
+    if json_stream:
+        # One JSON event per line, flushed as each interval completes
+        command += ['-J', '--json-stream']
+    else:
+        # Older iperf3 builds: plain text report, flushed per interval
+        command.append('--forceflush')
+
+    if bidir:
+        command.append('--bidir')
+    elif reverse:
+        command.append('-R')
+    return command
+
+
+class IntervalParser:
+    def __init__(self, json_stream, stream, buffer=None, direction=samples.CONST_UPLOAD):
+        self.json_stream = json_stream
+        # With -P 1 iperf3 prints no [SUM] line, so the stream line is the total
+        self.sum_tag = 'SUM' if stream > 1 else None
+        # Intervals are written straight into the buffer's columns; events only tell the caller something arrived
+        self.buffer = buffer if buffer is not None else samples.SampleBuffer()
+        self.direction = direction
+        # Lines iperf3 sent that could not be decoded
+        self.errors = 0
+
+    def parse_line(self, line):
+        line = line.strip()
+        if not line:
+            return None
+        if self.json_stream:
+            return self._parse_json_line(line)
+        return self._parse_text_line(line)
+
+    def _parse_json_line(self, line):
+        if not line.startswith('{'):
+            if 'error' in line:
+                return {'event': 'error', 'error': line}
+            return None
+
+        try:
+            event, data = iperf_parser.parse_stream_line(line)
+        except ValueError:
+            self.errors += 1
+            return {'event': 'error', 'error': 'Failed to parse JSON output from iperf3'}
+
+        if event == 'interval':
+            return self._store_interval(data)
+        if event == 'error':
+            return {'event': 'error', 'error': data}
+        if event == 'end':
+            return {'event': 'end', 'summary': data}
+        return None
+
+    def _store_interval(self, data):
+        if 'sum' not in data:
+            return None
+        now = time.time()
+        bidir = 'sum_bidir_reverse' in data
+        total = data['sum']
+        rows = [(now, self.direction, samples.CONST_SUM, total['bits_per_second'],
+                 total.get('retransmits', samples.CONST_UNKNOWN), _NAN, samples.CONST_UNKNOWN)]
+        result = {'event': 'interval', 'bits_per_second': total['bits_per_second']}
+        if bidir:
+            reverse = data['sum_bidir_reverse']
+            rows.append((now, samples.CONST_DOWNLOAD, samples.CONST_SUM, reverse['bits_per_second'],
+                         reverse.get('retransmits', samples.CONST_UNKNOWN), _NAN, samples.CONST_UNKNOWN))
+            result['reverse_bits_per_second'] = reverse['bits_per_second']
+
+        for stream in data.get('streams', ()):
+            # --bidir mixes both directions in one list; each stream says which side it sends from
+            direction = self.direction
+            if bidir and not stream.get('sender', True):
+                direction = samples.CONST_DOWNLOAD
+            rows.append((now, direction, stream.get('socket', 0), stream['bits_per_second'],
+                         stream.get('retransmits', samples.CONST_UNKNOWN), stream.get('rtt', _NAN),
+                         stream.get('snd_cwnd', samples.CONST_UNKNOWN)))
+        self.buffer.extend(rows)
+        return result
+
+    def _parse_text_line(self, line):
+        if 'iperf3: error' in line:
+            return {'event': 'error', 'error': line.split('error - ', 1)[-1]}
+        if line.startswith('iperf Done'):
+            return {'event': 'end'}
+
+        match = _TEXT_INTERVAL.match(line)
+        if match is None:
+            return None
+        tag, role, _, _, value, unit, rest = match.groups()
+        # Final summary lines carry a sender/receiver marker
+        if 'sender' in rest or 'receiver' in rest:
+            return None
+
+        # --bidir tags each line with the client side it was measured on
+        direction = samples.CONST_DOWNLOAD if role == 'RX' else self.direction
+        bits_per_second = float(value) * CONST_UNITS[unit]
+        retransmits, cwnd = samples.CONST_UNKNOWN, samples.CONST_UNKNOWN
+        sender = _TEXT_SENDER.match(rest)
+        if sender is not None:
+            retransmits = int(sender.group(1))
+            if sender.group(2) is not None:
+                cwnd = int(float(sender.group(2)) * CONST_BYTE_UNITS[sender.group(3)])
+
+        now = time.time()
+        is_total = (tag == 'SUM') == (self.sum_tag == 'SUM')
+        rows = []
+        if tag != 'SUM':
+            rows.append((now, direction, int(tag), bits_per_second, retransmits, _NAN, cwnd))
+        if is_total:
+            rows.append((now, direction, samples.CONST_SUM, bits_per_second, retransmits, _NAN, samples.CONST_UNKNOWN))
+        self.buffer.extend(rows)
+        if not is_total:
+            return None
+        key = 'reverse_bits_per_second' if role == 'RX' else 'bits_per_second'
+        return {'event': 'interval', key: bits_per_second}
@@ -0,0 +1,128 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+CONST_BACKENDS = ('auto', 'json', 'orjson')
+# What end_summary keeps of iperf3's "end" section
+CONST_END_SUMS = ('sum_sent', 'sum_received', 'sum', 'sum_sent_bidir_reverse', 'sum_received_bidir_reverse')
+
+_decoder = json.JSONDecoder()
+# Nothing inside an interval opens an object under "end" ("end" there is a number), so this only hits the
+# top-level end section of a -J report or the data of a --json-stream end event
+_END_SECTION = re.compile(r'"end"\s*:\s*\{')
+_SUM = re.compile(r'"(sum|sum_bidir_reverse)"\s*:\s*\{')
+_STREAMS = re.compile(r'"streams"\s*:\s*\[')
+_EVENT = re.compile(r'^\{\s*"event"\s*:\s*"(\w+)"')
+_ERROR = re.compile(r'"error"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def _use_orjson(backend):
+    if backend not in CONST_BACKENDS:
+        raise ValueError(f"unknown JSON backend: {backend}")
+    if backend == 'orjson' and orjson is None:
+        raise RuntimeError("the orjson backend needs orjson (pip install orjson)")
+    return backend == 'orjson' or (backend == 'auto' and orjson is not None)
+
+
+def _loads(text, backend='auto'):
+    return orjson.loads(text) if _use_orjson(backend) else json.loads(text)
+
+
+def _decode_at(text, index):
+    # raw_decode builds just the one value starting at index, not the document around it
+    return _decoder.raw_decode(text, index)
+
+
+def interval_sums(text, stop=None):
+    # Yields one {'sum': ..., 'sum_bidir_reverse': ...} dict per interval, in order, decoding only the sum objects
+    stop = len(text) if stop is None else stop
+    interval = {}
+    position = 0
+    while True:
+        match = _SUM.search(text, position, stop)
+        if match is None:
+            break
+        value, position = _decode_at(text, match.end() - 1)
+        key = match.group(1)
+        # Every interval has exactly one "sum", and the reverse sum follows it
+        if key == 'sum' and interval:
+            yield interval
+            interval = {}
+        interval[key] = value
+    if interval:
+        yield interval
+
+
+def interval_data(line):
+    # iperf3 writes an interval's "streams" list before its sums, so the sums are searched for after it
+    data = {}
+    position = 0
+    match = _STREAMS.search(line)
+    if match is not None:
+        data['streams'], position = _decode_at(line, match.end() - 1)
+    data.update(next(interval_sums(line[position:]), {}))
+    return data
+
+
+def end_summary(end):
+    # Sender/receiver totals and CPU use out of a decoded "end" section
+    summary = {key: end[key] for key in CONST_END_SUMS if key in end}
+    if 'cpu_utilization_percent' in end:
+        summary['cpu_utilization_percent'] = end['cpu_utilization_percent']
+    return summary
+
+
+def parse_report(text, streams=False, backend='auto'):
+    # Monolithic `iperf3 -J` output, for reports saved by other tools or older runs; the engine itself always
+    # reads line by line (parse_stream_line or the text parser). Without streams only the sum objects and the
+    # end section are decoded, which skips nearly all of a -P 128 report. Per-stream figures are most of the
+    # document, so then a full decode (orjson when available) beats picking them out one by one.
+    if streams:
+        document = _loads(text, backend)
+        intervals = document.get('intervals', [])
+        return {
+            'intervals': [{key: interval[key] for key in ('sum', 'sum_bidir_reverse') if key in interval}
+                          for interval in intervals],
+            'streams': [interval.get('streams', []) for interval in intervals],
+            'end': end_summary(document['end']) if document.get('end') else {},
+            'error': document.get('error'),
+        }
+
+    match = _END_SECTION.search(text)
+    stop = match.start() if match else len(text)
+    report = {
+        'intervals': list(interval_sums(text, stop)),
+        'end': end_summary(_decode_at(text, match.end() - 1)[0]) if match else {},
+        'error': None,
+    }
+    error = _ERROR.search(text, stop if match else 0)
+    if error is not None:
+        report['error'] = json.loads(f'"{error.group(1)}"')
+    return report
+
+
+def parse_stream_line(line, streams=True, backend='auto'):
+    # One `--json-stream` line -> (event, data). Interval data keeps the sums, plus the per-stream list when
+    # asked for; an end event is reduced to end_summary.
+    match = _EVENT.match(line)
+    if match is not None and match.group(1) == 'interval':
+        if not streams:
+            return 'interval', next(interval_sums(line), {})
+        # orjson builds the whole line ~3x faster than the json module; without it, decode only the stream list
+        # and the sums, skipping the interval's other keys and the dicts wrapping it
+        if not _use_orjson(backend):
+            return 'interval', interval_data(line)
+
+    message = _loads(line, backend)
+    event = message.get('event')
+    data = message.get('data')
+    if event == 'interval':
+        return event, {key: data[key] for key in ('sum', 'sum_bidir_reverse', 'streams') if key in data}
+    if event == 'end':
+        return event, end_summary(data)
+    return event, data
@@ -0,0 +1,131 @@
+import time
+from collections import deque
+
+import tkinter as tk
+from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
+from matplotlib.figure import Figure
+
+import stats
+
+
+CONST_MAX_FPS = 5
+CONST_WINDOW = 300
+CONST_HEADROOM = 1.2
+
+
+class Series:
+    def __init__(self, window):
+        self.values = deque(maxlen=window)
+        self.count = 0
+
+    def extend(self, values):
+        self.values.extend(values)
+        self.count += len(values)
+
+    def xy(self):
+        start = self.count - len(self.values)
+        return range(start, self.count), self.values
+
+
+class LivePlot:
+    def __init__(self, master, window=CONST_WINDOW, max_fps=CONST_MAX_FPS):
+        self.window = window
+        self.min_interval = 1 / max_fps
+        self.fig = Figure(figsize=(5, 5), dpi=80)
+        self.axes = self.fig.add_subplot(111)
+        self.axes.set_xlabel('time (t)')
+        self.axes.set_ylabel('Speed (Mbps)')
+        self.axes.set_xlim(0, window)
+        self.axes.set_ylim(0, 1)
+        # Animated lines are left out of normal draws and blitted on top of the cached background
+        self.upload_line, = self.axes.plot([], [], label='Upload', animated=True)
+        self.download_line, = self.axes.plot([], [], label='Download', animated=True)
+        self.axes.legend()
+        self.upload = Series(window)
+        self.download = Series(window)
+
+        self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+        toolbar = NavigationToolbar2Tk(self.canvas, master)
+        toolbar.update()
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self._background = None
+        self._last_redraw = 0
+        self._pending = None
+        self.canvas.draw()
+
+    def append(self, upl=(), dowl=()):
+        self.upload.extend(upl)
+        self.download.extend(dowl)
+        # Cap the redraw rate: coalesce bursts of intervals into one frame
+        wait = self.min_interval - (time.monotonic() - self._last_redraw)
+        if wait <= 0:
+            self.redraw()
+        elif self._pending is None:
+            self._pending = self.canvas.get_tk_widget().after(int(wait * 1000), self.redraw)
+
+    def redraw(self):
+        self._pending = None
+        self._last_redraw = time.monotonic()
+        self.upload_line.set_data(*self.upload.xy())
+        self.download_line.set_data(*self.download.xy())
+
+        if self._rescale() or self._background is None:
+            # Axes moved: one full draw, which recaptures the background in _on_draw
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self._background)
+        self._draw_lines()
+        self.canvas.blit(self.axes.bbox)
+
+    def _rescale(self):
+        count = max(self.upload.count, self.download.count)
+        peak = max(max(self.upload.values, default=0), max(self.download.values, default=0))
+        xmin, xmax = self.axes.get_xlim()
+        ymax = self.axes.get_ylim()[1]
+        changed = False
+        if count > xmax:
+            # Slide a quarter window at a time so long runs don't force a full draw per point
+            xmax = count + self.window // 4
+            self.axes.set_xlim(max(0, xmax - self.window), xmax)
+            changed = True
+        if peak > ymax:
+            self.axes.set_ylim(0, peak * CONST_HEADROOM)
+            changed = True
+        return changed
+
+    def _draw_lines(self):
+        self.axes.draw_artist(self.upload_line)
+        self.axes.draw_artist(self.download_line)
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self._draw_lines()
+
+    def show_all(self, upload, download, rtt=None):
+        # Final view of a finished run: every point, no rolling window. Each series is (seconds since the run
+        # started, values), so the RTT probes line up with the intervals whatever the test mode.
+        (upload_times, upl), (download_times, dowl) = upload, download
+        self.upload = Series(None)
+        self.download = Series(None)
+        self.upload.extend(upl)
+        self.download.extend(dowl)
+        self.upload_line.set_data(upload_times, upl)
+        self.download_line.set_data(download_times, dowl)
+        self.axes.set_xlabel('elapsed (s)')
+        self.axes.set_xlim(0, max(max(upload_times, default=0), max(download_times, default=0), 1))
+        self.axes.set_ylim(0, max(max(upl, default=0), max(dowl, default=0), 1) * CONST_HEADROOM)
+        for line, times, values in ((self.upload_line, upload_times, upl), (self.download_line, download_times, dowl)):
+            # The same intervals the run's outlier count is made of
+            marked = stats.outlier_indices(list(values))
+            if marked:
+                self.axes.plot([times[index] for index in marked], [values[index] for index in marked],
+                               linestyle='', marker='x', color=line.get_color())
+        if rtt:
+            rtt_times, rtt_values = rtt
+            rtt_axes = self.axes.twinx()
+            # A lost probe is a gap in the line
+            rtt_axes.plot(rtt_times, [float('nan') if value is None else value for value in rtt_values],
+                          color='grey', linestyle=':', label='RTT')
+            rtt_axes.set_ylabel('RTT (ms)')
+        self.canvas.draw()
@@ -0,0 +1,112 @@
+import logging
+import re
+import socket
+import subprocess
+import time
+
+from supervisor import ProcessSupervisor
+
+
+CONST_PROBE_INTERVAL = 1
+CONST_PROBE_TIMEOUT = 3
+CONST_MAX_MISSED = 3
+
+log = logging.getLogger(__name__)
+
+_PING_REPLY = re.compile(r'icmp_seq=(\d+).*time=([\d.]+) ms')
+_PING_MISSED = re.compile(r'no answer yet for icmp_seq=(\d+)')
+
+
+class LivenessMonitor:
+    def __init__(self, server, port=5201, method='ping', interval=CONST_PROBE_INTERVAL, timeout=CONST_PROBE_TIMEOUT,
+                 max_missed=CONST_MAX_MISSED, supervisor=None):
+        if method not in ('ping', 'tcp'):
+            raise ValueError(f"unknown liveness probe: {method}")
+        self.server = server
+        self.port = port
+        self.method = method
+        self.interval = interval
+        self.timeout = timeout
+        self.max_missed = max_missed
+        self.supervisor = supervisor or ProcessSupervisor()
+        # (timestamp, rtt in ms or None for a lost probe)
+        self.samples = []
+        self.server_down = False
+        self._missed = 0
+
+    def run(self, stop_event):
+        if self.method == 'tcp':
+            self._run_tcp(stop_event)
+        else:
+            self._run_ping(stop_event)
+
+    def record(self, rtt, stop_event):
+        self.samples.append((time.time(), rtt))
+        self._missed = 0 if rtt is not None else self._missed + 1
+        if self._missed >= self.max_missed:
+            log.warning("server %s did not answer %d probes in a row", self.server, self._missed)
+            self.server_down = True
+            stop_event.set()
+
+    def ping_command(self):
+        # One long-lived ping; -O reports each missing reply instead of staying silent
+        return [
+            'ping',
+            '-n', '-O',
+            '-i', str(self.interval),
+            '-W', str(self.timeout),
+            self.server,
+        ]
+
+    def feed(self, line, stop_event):
+        match = _PING_REPLY.search(line)
+        if match:
+            self.record(float(match.group(2)), stop_event)
+        elif _PING_MISSED.search(line):
+            self.record(None, stop_event)
+
+    def _run_ping(self, stop_event):
+        try:
+            process = self.supervisor.spawn(self.ping_command(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                                            bufsize=1)
+        except OSError as e:
+            log.error("server check error: %s", e)
+            return
+
+        self.supervisor.watch(process, stop_event)
+        for line in process.stdout:
+            if stop_event.is_set():
+                break
+            self.feed(line, stop_event)
+
+        if process.wait() != 0 and not stop_event.is_set():
+            # ping exited on its own, e.g. the name no longer resolves
+            log.warning("server check for %s exited with %s", self.server, process.returncode)
+            self.server_down = True
+            stop_event.set()
+        process.stdout.close()
+        self.supervisor.release(process)
+
+    def _run_tcp(self, stop_event):
+        while not stop_event.is_set():
+            start_time = time.perf_counter()
+            try:
+                with socket.create_connection((self.server, self.port), timeout=self.timeout):
+                    rtt = (time.perf_counter() - start_time) * 1000
+            except OSError:
+                rtt = None
+            self.record(rtt, stop_event)
+            stop_event.wait(self.interval)
+
+    def stats(self):
+        rtts = [rtt for _, rtt in self.samples if rtt is not None]
+        stats = {
+            'probes': len(self.samples),
+            'loss_percent': 100 * (len(self.samples) - len(rtts)) / len(self.samples) if self.samples else None,
+            'rtt_ms': sum(rtts) / len(rtts) if rtts else None,
+            'jitter_ms': None,
+        }
+        if len(rtts) > 1:
+            # Mean difference between consecutive RTTs, as ping/iperf3 report jitter
+            stats['jitter_ms'] = sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+        return stats
@@ -0,0 +1,153 @@
+import logging
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from engine import BandwidthEngine
+from supervisor import ProcessSupervisor
+
+
+CONST_LOOPBACK = '127.0.0.1'
+CONST_PORTS = range(5301, 5305)
+CONST_READY_TIMEOUT = 3
+CONST_SELF_TEST_SECONDS = 5
+
+log = logging.getLogger(__name__)
+
+
+class ServerPool:
+    # A pool of `iperf3 -s` instances, one per port. An iperf3 server runs one test at a time, so each
+    # concurrent client leases its own port; a server that dies is restarted on its next lease.
+    def __init__(self, ports=CONST_PORTS, bind=CONST_LOOPBACK, supervisor=None):
+        self.ports = list(ports)
+        self.bind = bind
+        self.supervisor = supervisor or ProcessSupervisor()
+        # port -> process, for the servers that came up
+        self.servers = {}
+        self._leased = set()
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def command(self, port):
+        # --forceflush so "Server listening" reaches the pipe at once; -B keeps a loopback pool off the LAN
+        command = ['iperf3', '-s', '-p', str(port), '--forceflush']
+        if self.bind:
+            command += ['-B', self.bind]
+        return command
+
+    def start(self):
+        for port in self.ports:
+            if port not in self.servers:
+                self._spawn(port)
+        if not self.servers:
+            raise RuntimeError(f"no local iperf3 server could be started on ports {self.ports[0]}-{self.ports[-1]}")
+        return sorted(self.servers)
+
+    def _spawn(self, port):
+        try:
+            process = self.supervisor.spawn(self.command(port), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                            text=True, bufsize=1)
+        except OSError as e:
+            raise RuntimeError(f"could not start iperf3 -s: {e}")
+        ready = threading.Event()
+        # The server keeps printing a report per test, so its output is drained for as long as it runs
+        threading.Thread(target=self._drain, args=(process, port, ready), daemon=True).start()
+        if not ready.wait(CONST_READY_TIMEOUT) or process.poll() is not None:
+            log.warning("iperf3 server on port %d did not come up", port)
+            self.supervisor.stop(process)
+            return False
+        self.servers[port] = process
+        return True
+
+    def _drain(self, process, port, ready):
+        for line in process.stdout:
+            if 'Server listening' in line:
+                ready.set()
+            elif 'error' in line:
+                # e.g. "unable to start listener for connections: Address already in use"
+                log.warning("iperf3 server on port %d: %s", port, line.strip())
+        process.stdout.close()
+        process.wait()
+        ready.set()
+        self.supervisor.release(process)
+
+    def available(self):
+        with self._condition:
+            return [port for port in sorted(self.servers) if port not in self._leased]
+
+    def acquire(self, count=1, timeout=None):
+        # `count` consecutive ports, since a concurrent engine run uses port .. port + count - 1
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                # Checked on every wake-up: a server that could not be restarted may have broken the only block
+                if self._block(count, leased=True) is None:
+                    raise ValueError(f"no {count} consecutive local server ports in {sorted(self.servers)}")
+                ports = self._block(count)
+                if ports is not None:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"no {count} free local server ports")
+                self._condition.wait(remaining)
+            self._leased.update(ports)
+        for port in ports:
+            if self.servers[port].poll() is not None:
+                log.warning("iperf3 server on port %d exited, restarting", port)
+                if not self._spawn(port):
+                    del self.servers[port]
+                    self.release(ports)
+                    raise RuntimeError(f"local iperf3 server on port {port} could not be restarted")
+        return ports
+
+    def _block(self, count, leased=False):
+        # First run of `count` consecutive started servers; free ones only, unless leased ones may count too
+        for port in sorted(self.servers):
+            block = list(range(port, port + count))
+            if all(candidate in self.servers and (leased or candidate not in self._leased) for candidate in block):
+                return block
+        return None
+
+    def release(self, ports):
+        with self._condition:
+            self._leased.difference_update(ports)
+            self._condition.notify_all()
+
+    @contextmanager
+    def lease(self, count=1, timeout=None):
+        ports = self.acquire(count, timeout)
+        try:
+            yield ports
+        finally:
+            self.release(ports)
+
+    def stop(self):
+        for process in self.servers.values():
+            self.supervisor.stop(process)
+        self.servers = {}
+
+
+def self_test(pool, duration=CONST_SELF_TEST_SECONDS, stream=10, mode='sequential', engine_class=BandwidthEngine):
+    # Loopback run against the pool with the same -P and mode as the real test. Client and server share this
+    # host's CPU, so the result is a ceiling on what the host can measure, not a NIC figure.
+    count = 2 if mode == 'concurrent' else 1
+    with pool.lease(count) as ports:
+        engine = engine_class(server=CONST_LOOPBACK, port=ports[0], duration=duration, stream=stream, mode=mode, gap=0)
+        engine.run_tests()
+    summary = engine.summary()
+    if summary['average_upload_Mbps'] is None or summary['average_download_Mbps'] is None:
+        raise RuntimeError(f"loopback self-test produced no result: {', '.join(summary['errors']) or 'no intervals'}")
+    return {
+        'upload_Mbps': summary['average_upload_Mbps'],
+        'download_Mbps': summary['average_download_Mbps'],
+        'stream': stream,
+        'mode': mode,
+        'measured_at': time.time(),
+    }
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import signal
+import subprocess
+import threading
+
+from supervisor import ProcessSupervisor
+from wifi import WifiTelemetry
+
+
+CONST_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class ReplayPopen:
+    # Drop-in for subprocess.Popen (ProcessSupervisor(popen=...)) that plays recorded output back instead of
+    # running iperf3/ping, so the real parsing, supervision and reporting code runs without binaries or a server
+    def __init__(self, line_delay=0):
+        self.line_delay = line_delay
+        self.commands = []
+        self._fixtures = []
+
+    def add(self, program, path, args=(), returncode=0, loop=False, line_delay=None):
+        # The most specific match wins: ('iperf3', args=('-R',)) beats plain 'iperf3' for a download
+        with open(path if os.path.isabs(path) else os.path.join(CONST_FIXTURES, path)) as handle:
+            lines = handle.readlines()
+        self._fixtures.append((program, tuple(args), lines, returncode, loop,
+                               self.line_delay if line_delay is None else line_delay))
+        return self
+
+    def match(self, command):
+        program = os.path.basename(command[0])
+        candidates = [fixture for fixture in self._fixtures
+                      if fixture[0] == program and all(arg in command for arg in fixture[1])]
+        if not candidates:
+            raise FileNotFoundError(f"no replay fixture for: {' '.join(command)}")
+        return max(candidates, key=lambda fixture: len(fixture[1]))
+
+    def __call__(self, command, stdout=None, stderr=None, text=False, **kwargs):
+        self.commands.append(list(command))
+        _, _, lines, returncode, loop, line_delay = self.match(command)
+        return ReplayProcess(command, lines, returncode, loop, line_delay)
+
+    async def create(self, command):
+        # The same fixtures for AsyncBandwidthEngine(create=...), played back as tasks on its event loop
+        self.commands.append(list(command))
+        _, _, lines, returncode, loop, line_delay = self.match(command)
+        return AsyncReplayProcess(command, lines, returncode, loop, line_delay)
+
+
+class ReplayProcess:
+    _next_pid = 100000
+
+    def __init__(self, args, lines, returncode=0, loop=False, line_delay=0):
+        self.args = args
+        ReplayProcess._next_pid += 1
+        self.pid = ReplayProcess._next_pid
+        self.returncode = None
+        self._lines = lines
+        self._exit_code = returncode
+        self._loop = loop
+        self._line_delay = line_delay
+        self._signalled = threading.Event()
+        self._done = threading.Event()
+        self.stdout = _ReplayStream(self)
+        self.stderr = None
+
+    def _produce(self):
+        while True:
+            for line in self._lines:
+                # A signal ends output the way SIGINT ends iperf3 after its last flush
+                if self._signalled.is_set() or (self._line_delay and self._signalled.wait(self._line_delay)):
+                    return
+                yield line
+            if not self._loop:
+                return self._finish(self._exit_code)
+
+    def _finish(self, returncode):
+        if self.returncode is None:
+            self.returncode = returncode
+        self._done.set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def communicate(self, input=None, timeout=None):
+        output = self.stdout.read()
+        self.wait(timeout)
+        return output, ''
+
+    def send_signal(self, signum):
+        # Exits at once: nobody may be reading any more, and a stopped replay has nothing left to flush
+        self._signalled.set()
+        self._finish(-signum)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class AsyncReplayProcess:
+    # asyncio.subprocess.Process counterpart of ReplayProcess: stdout yields bytes lines, wait() is a coroutine
+    _next_pid = 200000
+
+    def __init__(self, args, lines, returncode=0, loop=False, line_delay=0):
+        self.args = args
+        AsyncReplayProcess._next_pid += 1
+        self.pid = AsyncReplayProcess._next_pid
+        self.returncode = None
+        self._lines = lines
+        self._exit_code = returncode
+        self._loop = loop
+        self._line_delay = line_delay
+        self._signalled = asyncio.Event()
+        self._done = asyncio.Event()
+        self.stdout = self._produce()
+
+    async def _produce(self):
+        while True:
+            for line in self._lines:
+                if self._signalled.is_set():
+                    return
+                if self._line_delay:
+                    try:
+                        await asyncio.wait_for(self._signalled.wait(), self._line_delay)
+                        return
+                    except TimeoutError:
+                        pass
+                yield line.encode()
+            if not self._loop:
+                self._finish(self._exit_code)
+                return
+
+    def _finish(self, returncode):
+        if self.returncode is None:
+            self.returncode = returncode
+        self._done.set()
+
+    async def wait(self):
+        await self._done.wait()
+        return self.returncode
+
+    def send_signal(self, signum):
+        self._signalled.set()
+        self._finish(-signum)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class _ReplayStream:
+    def __init__(self, process):
+        self._lines = process._produce()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def readline(self):
+        return next(self._lines, '')
+
+    def read(self):
+        return ''.join(self._lines)
+
+    def close(self):
+        self._lines.close()
+
+
+def default_replay(line_delay=0, iperf3='json_stream', ping='ping/reply.txt'):
+    # iperf3='json_stream' replays a 3.17 client; 'text' an older one that only has --forceflush output
+    replay = ReplayPopen(line_delay=line_delay)
+    if iperf3 == 'text':
+        replay.add('iperf3', 'iperf3/version_3.9.txt', args=('--version',))
+        replay.add('iperf3', 'iperf3/upload_P10.txt')
+        replay.add('iperf3', 'iperf3/download_P10.txt', args=('-R',))
+    else:
+        replay.add('iperf3', 'iperf3/version_3.17.txt', args=('--version',))
+        replay.add('iperf3', 'iperf3/upload_P10.jsonl')
+        replay.add('iperf3', 'iperf3/download_P10.jsonl', args=('-R',))
+        replay.add('iperf3', 'iperf3/bidir_P10.jsonl', args=('--bidir',))
+    # ping keeps going until it is stopped, like the real long-lived probe
+    replay.add('ping', ping, loop=True, line_delay=max(line_delay, 0.01))
+    return replay
+
+
+def replay_supervisor(replay=None):
+    return ProcessSupervisor(popen=replay or default_replay())
+
+
+def replay_wifi():
+    return WifiTelemetry(proc_root=os.path.join(CONST_FIXTURES, 'wifi', 'proc'),
+                         sys_root=os.path.join(CONST_FIXTURES, 'wifi', 'sys'))
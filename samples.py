@@ -0,0 +1,91 @@
+import threading
+from array import array
+
+
+CONST_UPLOAD = 0
+CONST_DOWNLOAD = 1
+CONST_DIRECTION_NAMES = ('upload', 'download')
+# Stream id of the per-interval aggregate ([SUM] / "sum") row
+CONST_SUM = -1
+CONST_UNKNOWN = -1
+
+# name -> array typecode; ~41 bytes a sample instead of a dict plus boxed floats per interval
+_COLUMNS = (
+    ('timestamp', 'd'),
+    ('direction', 'b'),
+    ('stream', 'i'),
+    ('bits_per_second', 'd'),
+    ('retransmits', 'i'),
+    ('rtt_us', 'd'),
+    ('cwnd', 'q'),
+)
+
+
+class SampleBuffer:
+    def __init__(self):
+        self.columns = {name: array(typecode) for name, typecode in _COLUMNS}
+        # Concurrent directions share one buffer; a row is only consistent if all its columns go in together
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns['timestamp'])
+
+    def append(self, timestamp, direction, stream, bits_per_second, retransmits=CONST_UNKNOWN, rtt_us=float('nan'),
+               cwnd=CONST_UNKNOWN):
+        with self._lock:
+            self._append(timestamp, direction, stream, bits_per_second, retransmits, rtt_us, cwnd)
+
+    def extend(self, rows):
+        with self._lock:
+            for row in rows:
+                self._append(*row)
+
+    def _append(self, timestamp, direction, stream, bits_per_second, retransmits, rtt_us, cwnd):
+        columns = self.columns
+        columns['timestamp'].append(timestamp)
+        columns['direction'].append(direction)
+        columns['stream'].append(stream)
+        columns['bits_per_second'].append(bits_per_second)
+        columns['retransmits'].append(retransmits)
+        columns['rtt_us'].append(rtt_us)
+        columns['cwnd'].append(cwnd)
+
+    def clear(self):
+        with self._lock:
+            self.columns = {name: array(typecode) for name, typecode in _COLUMNS}
+
+    def rows(self, direction=None, stream=CONST_SUM):
+        # (timestamp, direction, Mbps) for the aggregate rows, in arrival order
+        columns = self.columns
+        for timestamp, row_direction, row_stream, bits_per_second in zip(
+                columns['timestamp'], columns['direction'], columns['stream'], columns['bits_per_second']):
+            if row_stream == stream and (direction is None or row_direction == direction):
+                yield timestamp, row_direction, bits_per_second / 1e6
+
+    def series(self, direction, stream=CONST_SUM):
+        return [mbps for _, _, mbps in self.rows(direction, stream)]
+
+    def streams(self, direction):
+        # Per-stream Mbps series, keyed by iperf3's socket id
+        columns = self.columns
+        result = {}
+        for row_direction, stream, bits_per_second in zip(columns['direction'], columns['stream'],
+                                                          columns['bits_per_second']):
+            if stream != CONST_SUM and row_direction == direction:
+                result.setdefault(stream, []).append(bits_per_second / 1e6)
+        return result
+
+    def retransmits(self, direction):
+        # Only the sending side reports retransmits; None when no aggregate row has them
+        columns = self.columns
+        values = [retransmits for row_direction, stream, retransmits in zip(
+                      columns['direction'], columns['stream'], columns['retransmits'])
+                  if stream == CONST_SUM and row_direction == direction and retransmits != CONST_UNKNOWN]
+        return sum(values) if values else None
+
+    def to_numpy(self):
+        import numpy as np
+        # Copies: a live view would pin the arrays and make the next append raise BufferError
+        with self._lock:
+            return {name: np.frombuffer(column, dtype=column.typecode).copy() if len(column) else
+                    np.empty(0, dtype=column.typecode) for name, column in self.columns.items()}
@@ -0,0 +1,75 @@
+import threading
+
+
+CONST_MODES = ('sequential', 'concurrent', 'bidir')
+CONST_DIRECTIONS = ('upload', 'download')
+# Seconds between waves, so the server has released the previous test before the next connects
+CONST_GAP = 1
+
+
+def check_order(order):
+    order = tuple(order)
+    if not order:
+        raise ValueError("no test direction given")
+    unknown = [direction for direction in order if direction not in CONST_DIRECTIONS]
+    if unknown:
+        raise ValueError(f"unknown test direction: {', '.join(unknown)}")
+    if len(set(order)) != len(order):
+        raise ValueError(f"each direction at most once, got: {', '.join(order)}")
+    return order
+
+
+class TestScheduler:
+    def __init__(self, runner, targets, monitor=None, mode='sequential', order=CONST_DIRECTIONS, gap=CONST_GAP):
+        if mode not in CONST_MODES:
+            raise ValueError(f"unknown test mode: {mode}")
+        self.runner = runner
+        self.monitor = monitor
+        self.mode = mode
+        self.order = check_order(order)
+        self.gap = gap
+        # Each target is (server, [ports]); a concurrent run needs one server port per client
+        self.targets = [(server, list(ports)) for server, ports in targets]
+
+    def plan(self):
+        if self.mode == 'bidir':
+            return [[('bidir', server, ports[0]) for server, ports in self.targets]]
+
+        if self.mode == 'concurrent':
+            wave = []
+            for server, ports in self.targets:
+                if len(ports) < len(self.order):
+                    raise ValueError(f"concurrent mode needs {len(self.order)} ports on {server}, got {len(ports)}")
+                wave.extend((direction, server, port) for direction, port in zip(self.order, ports))
+            return [wave]
+
+        return [[(direction, server, ports[0])] for server, ports in self.targets for direction in self.order]
+
+    def run(self, stop_event=None):
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        monitors = []
+        if self.monitor is not None:
+            monitors = [threading.Thread(target=self.monitor, args=(stop_event, server), daemon=True)
+                        for server, _ in self.targets]
+            for thread in monitors:
+                thread.start()
+
+        for index, wave in enumerate(self.plan()):
+            if stop_event.is_set():
+                break
+            if index and stop_event.wait(self.gap):
+                break
+
+            threads = [threading.Thread(target=self.runner, args=(direction, stop_event, server, port))
+                       for direction, server, port in wave]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        stop_event.set()
+        # The stop ends every probe; joining them means a server-down verdict is in before results are processed
+        for thread in monitors:
+            thread.join()
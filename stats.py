@@ -0,0 +1,176 @@
+import operator
+import re
+
+
+CONST_PERCENTILES = (5, 50, 95)
+CONST_SLOW_START = 2
+CONST_OUTLIER_Z = 3.5
+CONST_METRICS = ('count', 'mean', 'std', 'cv', 'min', 'max', 'p5', 'p50', 'p95', 'outliers')
+# Upper bound on the cells of one padded block in summarize_batch (8 bytes each, a few working copies)
+CONST_BATCH_CELLS = 2 ** 21
+# Per-band acceptance, formerly hard-coded in the power Wi-Fi test
+CONST_BAND_RULES = {
+    '2.4Ghz': [('download', 'mean', '>=', 75)],
+    '5.0Ghz': [('download', 'mean', '>=', 280)],
+}
+
+_OPERATORS = {'>=': operator.ge, '>': operator.gt, '<=': operator.le, '<': operator.lt}
+_RULE = re.compile(r'^\s*(upload|download)\.(\w+)\s*(>=|<=|>|<)\s*(-?[\d.]+)\s*$')
+
+
+def _numpy():
+    # NumPy costs ~100 ms to import; only pay for it once a summary is actually asked for
+    import numpy
+    return numpy
+
+
+def summarize(values, trim=CONST_SLOW_START, outlier_z=CONST_OUTLIER_Z):
+    batch = summarize_batch([values], trim=trim, outlier_z=outlier_z)
+    return {metric: _scalar(batch[metric][0]) for metric in CONST_METRICS}
+
+
+def summarize_batch(series, trim=CONST_SLOW_START, outlier_z=CONST_OUTLIER_Z):
+    # series: one interval sequence per run. Runs are padded with NaN into 2-D blocks so tens of thousands of
+    # them are summarized with a handful of vectorized calls instead of a Python loop each. Rows go into the
+    # blocks by length, and a block stays under CONST_BATCH_CELLS, so one long run only pads its neighbours
+    # in length and memory stays bounded however many runs there are.
+    np = _numpy()
+    series = [_trimmed(values, trim) for values in series]
+    result = {metric: np.empty(len(series), dtype=int if metric in ('count', 'outliers') else float)
+              for metric in CONST_METRICS}
+    by_length = sorted(range(len(series)), key=lambda row: len(series[row]))
+    start = 0
+    while start < len(by_length):
+        stop = start + 1
+        while (stop < len(by_length)
+               and (stop + 1 - start) * len(series[by_length[stop]]) <= CONST_BATCH_CELLS):
+            stop += 1
+        rows = by_length[start:stop]
+        block = _summarize_block(np, [series[row] for row in rows], outlier_z)
+        for metric in CONST_METRICS:
+            result[metric][rows] = block[metric]
+        start = stop
+    return result
+
+
+def _summarize_block(np, series, outlier_z):
+    width = max((len(values) for values in series), default=0)
+    data = np.full((len(series), max(width, 1)), np.nan)
+    for row, values in enumerate(series):
+        data[row, :len(values)] = values
+
+    count = np.count_nonzero(~np.isnan(data), axis=1)
+    empty = count == 0
+    # Empty rows would only raise all-NaN warnings; give them a dummy value and blank them afterwards
+    data[empty, 0] = 0
+    mean = np.nanmean(data, axis=1)
+    std = np.nanstd(data, axis=1)
+    # np.nanpercentile loops over rows in Python; sorting once (NaN padding sorts last) and interpolating
+    # by each row's own count keeps the whole batch vectorized
+    filled = np.maximum(count, 1)
+    ordered = np.sort(data, axis=1)
+    p5, p50, p95 = (_percentile(np, ordered, filled, q) for q in CONST_PERCENTILES)
+    minimum, maximum = np.nanmin(data, axis=1), np.nanmax(data, axis=1)
+    del ordered
+
+    # Modified z-score on the median absolute deviation: robust to the very dips it is looking for
+    deviation = np.abs(data - p50[:, None])
+    del data
+    mad = _percentile(np, np.sort(deviation, axis=1), filled, 50)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = np.where(mean > 0, std / mean, np.nan)
+        deviation *= 0.6745 / mad[:, None]
+    outliers = np.count_nonzero((deviation > outlier_z) & (mad[:, None] > 0), axis=1)
+
+    result = {
+        'count': count,
+        'mean': mean,
+        'std': std,
+        'cv': cv,
+        'min': minimum,
+        'max': maximum,
+        'p5': p5,
+        'p50': p50,
+        'p95': p95,
+        'outliers': outliers,
+    }
+    for metric in CONST_METRICS:
+        if metric not in ('count', 'outliers'):
+            result[metric][empty] = np.nan
+    return result
+
+
+def outlier_indices(values, trim=CONST_SLOW_START, outlier_z=CONST_OUTLIER_Z):
+    # Positions in the untrimmed series, for marking points on a plot
+    np = _numpy()
+    offset = len(values) - len(_trimmed(values, trim))
+    data = np.asarray(values[offset:], dtype=float)
+    if data.size == 0:
+        return []
+    median = np.median(data)
+    mad = np.median(np.abs(data - median))
+    if mad == 0:
+        return []
+    return [int(index) + offset for index in np.flatnonzero(0.6745 * np.abs(data - median) / mad > outlier_z)]
+
+
+def run_stats(upl, dowl, trim=CONST_SLOW_START):
+    batch = summarize_batch([upl, dowl], trim=trim)
+    return {direction: {metric: _scalar(batch[metric][row]) for metric in CONST_METRICS}
+            for row, direction in enumerate(('upload', 'download'))}
+
+
+def summarize_runs(store, run_ids, trim=CONST_SLOW_START):
+    # Fleet report: every stored run's intervals in one pass over the samples table and one batch per direction
+    series = {'upload': {}, 'download': {}}
+    for run_id, _, direction, mbps in store.iter_samples(run_ids, with_runs=False):
+        series[direction].setdefault(run_id, []).append(mbps)
+
+    run_ids = list(run_ids)
+    report = {run_id: {} for run_id in run_ids}
+    for direction, by_run in series.items():
+        batch = summarize_batch([by_run.get(run_id, ()) for run_id in run_ids], trim=trim)
+        for row, run_id in enumerate(run_ids):
+            report[run_id][direction] = {metric: _scalar(batch[metric][row]) for metric in CONST_METRICS}
+    return report
+
+
+def parse_rule(text):
+    # "download.p5>=50" -> ('download', 'p5', '>=', 50.0)
+    match = _RULE.match(text)
+    if match is None or match.group(2) not in CONST_METRICS:
+        raise ValueError(f"invalid rule: {text!r} (expected e.g. download.p50>=280)")
+    direction, metric, op, threshold = match.groups()
+    return direction, metric, op, float(threshold)
+
+
+def evaluate(rules, stats):
+    # Returns the rules that failed; a metric that couldn't be computed fails its rule
+    failures = []
+    for direction, metric, op, threshold in rules:
+        value = stats[direction][metric]
+        if value is None or not _OPERATORS[op](value, threshold):
+            failures.append(f"{direction}.{metric} {value} {op} {threshold}")
+    return failures
+
+
+def _percentile(np, ordered, count, q):
+    # Linear interpolation between closest ranks, as np.percentile does by default
+    position = (count - 1) * (q / 100)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, count - 1)
+    rows = np.arange(len(ordered))
+    fraction = position - lower
+    return ordered[rows, lower] * (1 - fraction) + ordered[rows, upper] * fraction
+
+
+def _trimmed(values, trim):
+    # Skip TCP slow start, unless that would leave nothing
+    return values[trim:] if len(values) > trim else values
+
+
+def _scalar(value):
+    value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
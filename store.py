@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import time
+
+
+CONST_DEFAULT_DB = 'results.db'
+CONST_QUERY_CHUNK = 500
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    server TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    stream INTEGER NOT NULL,
+    duration INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    band TEXT,
+    rssi INTEGER,
+    average_upload_Mbps REAL,
+    average_download_Mbps REAL,
+    passed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    timestamp REAL NOT NULL,
+    direction TEXT NOT NULL,
+    Mbps REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_server_band_started ON runs (server, band, started_at);
+CREATE INDEX IF NOT EXISTS runs_band_started ON runs (band, started_at);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started_at);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id, direction);
+'''
+
+_RUN_COLUMNS = ('run_id', 'started_at', 'server', 'port', 'stream', 'duration', 'mode', 'band', 'rssi',
+                'average_upload_Mbps', 'average_download_Mbps', 'passed')
+
+
+class ResultStore:
+    def __init__(self, path=CONST_DEFAULT_DB):
+        self.path = path
+        # Engines save from worker threads; one connection behind a lock keeps writes serialized
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(_SCHEMA)
+
+    def save_run(self, summary, samples, band=None, rssi=None, started_at=None):
+        # samples: iterable of (timestamp, direction, Mbps)
+        average_upl = summary['average_upload_Mbps']
+        average_dowl = summary['average_download_Mbps']
+        row = (
+            started_at or time.time(),
+            summary['server'],
+            summary['port'],
+            summary['stream'],
+            summary['duration'],
+            summary['mode'],
+            band,
+            rssi,
+            average_upl if isinstance(average_upl, float) else None,
+            average_dowl if isinstance(average_dowl, float) else None,
+            int(summary['passed']),
+        )
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO runs (started_at, server, port, stream, duration, mode, band, rssi, '
+                'average_upload_Mbps, average_download_Mbps, passed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            run_id = cursor.lastrowid
+            self._connection.executemany(
+                'INSERT INTO samples (run_id, timestamp, direction, Mbps) VALUES (?, ?, ?, ?)',
+                ((run_id, timestamp, direction, mbps) for timestamp, direction, mbps in samples))
+        return run_id
+
+    def query_runs(self, server=None, band=None, since=None, until=None, limit=None):
+        clauses = []
+        params = []
+        for column, op, value in (('server', '=', server), ('band', '=', band),
+                                  ('started_at', '>=', since), ('started_at', '<', until)):
+            if value is not None:
+                clauses.append(f'{column} {op} ?')
+                params.append(value)
+
+        sql = f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs"
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY started_at DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [dict(zip(_RUN_COLUMNS, row)) for row in rows]
+
+    def samples(self, run_id, direction=None):
+        sql = 'SELECT timestamp, direction, Mbps FROM samples WHERE run_id = ?'
+        params = [run_id]
+        if direction is not None:
+            sql += ' AND direction = ?'
+            params.append(direction)
+        with self._lock:
+            return self._connection.execute(sql + ' ORDER BY rowid', params).fetchall()
+
+    def get_runs(self, run_ids):
+        for chunk in _chunks(run_ids):
+            placeholders = ', '.join('?' * len(chunk))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs WHERE run_id IN ({placeholders}) ORDER BY run_id",
+                    chunk).fetchall()
+            for row in rows:
+                yield dict(zip(_RUN_COLUMNS, row))
+
+    def iter_samples(self, run_ids, with_runs=True):
+        if with_runs:
+            select = ('SELECT s.run_id, r.started_at, r.server, r.port, r.stream, r.band, r.rssi, '
+                      's.timestamp, s.direction, s.Mbps FROM samples s JOIN runs r ON r.run_id = s.run_id')
+        else:
+            select = 'SELECT s.run_id, s.timestamp, s.direction, s.Mbps FROM samples s'
+
+        # Bulk reads go through their own read-only connection so long exports don't hold up writers
+        connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        try:
+            for chunk in _chunks(run_ids):
+                placeholders = ', '.join('?' * len(chunk))
+                yield from connection.execute(
+                    f'{select} WHERE s.run_id IN ({placeholders}) ORDER BY s.run_id, s.rowid', chunk)
+        finally:
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _chunks(run_ids):
+    # Keep IN (...) lists under SQLite's bound-parameter limit
+    run_ids = list(run_ids)
+    for start in range(0, len(run_ids), CONST_QUERY_CHUNK):
+        yield run_ids[start:start + CONST_QUERY_CHUNK]
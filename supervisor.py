@@ -0,0 +1,92 @@
+import logging
+import os
+import signal
+import subprocess
+import threading
+
+import instrumentation
+
+
+CONST_SIGINT_GRACE = 0.5
+CONST_SIGTERM_GRACE = 1.0
+CONST_WATCH_INTERVAL = 0.1
+
+log = logging.getLogger(__name__)
+
+
+class ProcessSupervisor:
+    def __init__(self, popen=subprocess.Popen):
+        self.popen = popen
+        self._children = set()
+        self._stopping = set()
+        self._lock = threading.Lock()
+
+    def spawn(self, command, **kwargs):
+        program = os.path.basename(command[0])
+        instrumentation.count('subprocesses_spawned', program=program)
+        log.debug("spawn: %s", ' '.join(command))
+        process = self.popen(command, **kwargs)
+        with self._lock:
+            self._children.add(process)
+        return process
+
+    def run(self, command, timeout=None):
+        process = self.spawn(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.stop(process)
+            stdout, stderr = process.communicate()
+        finally:
+            self.release(process)
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    def release(self, process):
+        with self._lock:
+            self._children.discard(process)
+            self._stopping.discard(process)
+
+    def children(self):
+        with self._lock:
+            return [process for process in self._children if process.poll() is None]
+
+    def stop(self, process):
+        # Escalation waits on the child, so it runs off the caller's thread and stop() returns at once
+        with self._lock:
+            if process in self._stopping or process.poll() is not None:
+                return
+            self._stopping.add(process)
+        threading.Thread(target=self._escalate, args=(process,), daemon=True).start()
+
+    def watch(self, process, stop_event):
+        threading.Thread(target=self._stop_on_event, args=(process, stop_event), daemon=True).start()
+
+    def _stop_on_event(self, process, stop_event):
+        while not stop_event.wait(CONST_WATCH_INTERVAL):
+            if process.poll() is not None:
+                return
+        self.stop(process)
+
+    def cancel(self):
+        for process in self.children():
+            self.stop(process)
+
+    def _escalate(self, process):
+        # SIGINT lets iperf3 flush its last interval and summary; TERM/KILL only if it does not exit
+        steps = [
+            (signal.SIGINT, CONST_SIGINT_GRACE),
+            (signal.SIGTERM, CONST_SIGTERM_GRACE),
+            (signal.SIGKILL, None),
+        ]
+        for signum, grace in steps:
+            log.debug("signal %s -> pid %s", signum.name, process.pid)
+            try:
+                process.send_signal(signum)
+            except ProcessLookupError:
+                break
+            try:
+                process.wait(timeout=grace)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        self.release(process)
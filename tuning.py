@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import BandwidthEngine
+import iperf_client
+import stats
+
+
+CONST_STREAMS = (1, 2, 4, 8, 16, 32)
+# None leaves the window to the kernel's autotuning
+CONST_WINDOWS = (None, '512K', '2M')
+CONST_PROBE_SECONDS = 5
+# Pick the smallest configuration within this share of the best probe
+CONST_WITHIN = 0.05
+CONST_CACHE_PATH = 'tuning.json'
+CONST_CACHE_MAX_AGE = 7 * 86400
+
+log = logging.getLogger(__name__)
+
+
+def choose(probes, within=CONST_WITHIN):
+    # Smallest (streams, window) whose throughput is within `within` of the peak: fewer streams cost less client
+    # CPU and vary less between runs, and a link that is already saturated gains nothing from more
+    measured = [probe for probe in probes if probe['Mbps'] is not None]
+    if not measured:
+        return None
+    peak = max(probe['Mbps'] for probe in measured)
+    candidates = [probe for probe in measured if probe['Mbps'] >= (1 - within) * peak]
+    best = min(candidates, key=lambda probe: (probe['stream'], iperf_client.window_bytes(probe['window'])))
+    return dict(best, peak_Mbps=peak)
+
+
+class TuningCache:
+    # server/band -> chosen configuration, in a small JSON file next to the results database
+    def __init__(self, path=CONST_CACHE_PATH, max_age=CONST_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(server, band):
+        return f"{server}|{band or '-'}"
+
+    def _load(self):
+        try:
+            with open(self.path) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, server, band=None):
+        entry = self._load().get(self.key(server, band))
+        if entry is None or time.time() - entry['measured_at'] > self.max_age:
+            return None
+        return entry
+
+    def put(self, server, band, choice):
+        with self._lock:
+            entries = self._load()
+            entries[self.key(server, band)] = choice
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as handle:
+                json.dump(entries, handle, indent=2)
+            os.replace(temp_path, self.path)
+
+
+class StreamTuner:
+    def __init__(self, streams=CONST_STREAMS, windows=CONST_WINDOWS, seconds=CONST_PROBE_SECONDS,
+                 within=CONST_WITHIN, direction='download', cache=None, engine_class=BandwidthEngine, **engine_options):
+        self.streams = list(streams)
+        self.windows = list(windows)
+        self.seconds = seconds
+        self.within = within
+        self.direction = direction
+        self.cache = cache
+        self.engine_class = engine_class
+        # Anything else a probe engine needs: supervisor, timeout, probe, wifi, ...
+        self.engine_options = engine_options
+        self.cancelled = threading.Event()
+        self._engines = set()
+        self._lock = threading.Lock()
+
+    def probe(self, server, port, stream, window):
+        engine = self.engine_class(server=server, port=port, duration=self.seconds, stream=stream, window=window,
+                                   order=(self.direction,), gap=0, **self.engine_options)
+        with self._lock:
+            self._engines.add(engine)
+        try:
+            engine.run_tests()
+        finally:
+            with self._lock:
+                self._engines.discard(engine)
+        values = engine.dowl if self.direction == 'download' else engine.upl
+        # Mean after the slow-start intervals, the same figure the pass rules see
+        mbps = stats.summarize(values)['mean'] if values else None
+        log.info("probe %s:%s -P %d -w %s: %s Mbps", server, port, stream, window or 'default', mbps)
+        return {'stream': stream, 'window': window, 'Mbps': mbps,
+                'errors': [result['error'] for result in engine.test_results if 'error' in result]}
+
+    def sweep(self, server, port, band=None):
+        # Probes of one link run one after another: concurrent probes would split the link and all under-read
+        probes = []
+        for stream in self.streams:
+            for window in self.windows:
+                if self.cancelled.is_set():
+                    return None
+                probes.append(self.probe(server, port, stream, window))
+        choice = choose(probes, self.within)
+        if choice is None:
+            return None
+        choice.update(server=server, port=port, band=band, direction=self.direction, measured_at=time.time(),
+                      probes=probes)
+        if self.cache is not None:
+            self.cache.put(server, band, choice)
+        return choice
+
+    def tuned(self, server, port, band=None, retune=False):
+        # The cached choice for this server and band, sweeping only when there is none (or it is stale)
+        if self.cache is not None and not retune:
+            cached = self.cache.get(server, band)
+            if cached is not None:
+                return cached
+        return self.sweep(server, port, band)
+
+    def sweep_many(self, targets, band=None, retune=False):
+        # Sweeps of different servers overlap, which assumes the bottleneck is on their side rather than this
+        # host's own uplink; ports of one server share a link and are tuned once, on the first port listed
+        servers = {}
+        for server, port in targets:
+            servers.setdefault(server, port)
+        with ThreadPoolExecutor(max_workers=len(servers) or 1) as pool:
+            futures = {server: pool.submit(self.tuned, server, port, band, retune) for server, port in servers.items()}
+        return {server: future.result() for server, future in futures.items()}
+
+    def cancel(self):
+        self.cancelled.set()
+        with self._lock:
+            engines = list(self._engines)
+        for engine in engines:
+            engine.cancel()
@@ -0,0 +1,77 @@
+import logging
+import queue
+
+
+CONST_DRAIN_MS = 50
+CONST_MAX_EVENTS = 1000
+
+log = logging.getLogger(__name__)
+
+
+class UIEventQueue:
+    def __init__(self, root, interval_ms=CONST_DRAIN_MS, max_events=CONST_MAX_EVENTS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.max_events = max_events
+        self._queue = queue.SimpleQueue()
+        self._handlers = {}
+        self._coalesced = set()
+        self._after_id = None
+
+    def register(self, kind, handler, coalesce=False):
+        # A coalesced handler gets every payload posted since the last drain as one list
+        self._handlers[kind] = handler
+        if coalesce:
+            self._coalesced.add(kind)
+
+    def post(self, kind, payload=None):
+        # Safe from any thread: workers never touch Tk themselves
+        self._queue.put((kind, payload))
+
+    def call(self, func, *args):
+        self._queue.put((None, (func, args)))
+
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _drain(self):
+        batches = {}
+        try:
+            for _ in range(self.max_events):
+                try:
+                    kind, payload = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if kind in self._coalesced:
+                    batches.setdefault(kind, []).append(payload)
+                    continue
+                # Deliver what was batched so far first, so handlers see events in posting order
+                self._flush(batches)
+                if kind is None:
+                    func, args = payload
+                    self._dispatch(func, *args)
+                else:
+                    self._dispatch(self._handlers[kind], payload)
+            self._flush(batches)
+        finally:
+            # Rescheduled only after handlers return, so a modal dialog in one can't re-enter the drain; and
+            # always rescheduled, so one failing handler can't strand every later event in the queue
+            self._after_id = self.root.after(self.interval_ms, self._drain)
+
+    @staticmethod
+    def _dispatch(func, *args):
+        try:
+            func(*args)
+        except Exception:
+            log.exception("UI event handler %r failed", func)
+
+    def _flush(self, batches):
+        for kind, payloads in batches.items():
+            self._dispatch(self._handlers[kind], payloads)
+        batches.clear()
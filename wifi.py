@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+
+CONST_SAMPLE_INTERVAL = 1.0
+CONST_NOISE_UNSET = -256
+
+
+class WifiTelemetry:
+    def __init__(self, proc_root='/proc', sys_root='/sys'):
+        self.wireless_path = os.path.join(proc_root, 'net', 'wireless')
+        self.net_path = os.path.join(sys_root, 'class', 'net')
+        self._interfaces = []
+        self._interfaces_key = None
+        self._lock = threading.Lock()
+
+    def interfaces(self):
+        # Listing /sys/class/net is one cheap syscall; the per-interface checks only rerun when it changes
+        try:
+            names = tuple(sorted(os.listdir(self.net_path)))
+        except OSError:
+            names = ()
+        with self._lock:
+            if names != self._interfaces_key:
+                self._interfaces_key = names
+                self._interfaces = [name for name in names if self._is_wireless(name)]
+            return list(self._interfaces)
+
+    def _is_wireless(self, name):
+        path = os.path.join(self.net_path, name)
+        return os.path.isdir(os.path.join(path, 'wireless')) or os.path.exists(os.path.join(path, 'phy80211'))
+
+    def wireless_interface(self):
+        interfaces = self.interfaces()
+        return interfaces[0] if interfaces else None
+
+    def read_wireless(self):
+        try:
+            with open(self.wireless_path) as handle:
+                lines = handle.readlines()
+        except OSError:
+            return {}
+
+        stats = {}
+        # Two header lines, then: "wlan0: 0000   54.  -56.  -256  ..."
+        for line in lines[2:]:
+            name, _, values = line.partition(':')
+            fields = values.split()
+            if len(fields) < 4:
+                continue
+            stats[name.strip()] = {
+                'link_quality': float(fields[1].rstrip('.')),
+                'signal_dBm': _dbm(float(fields[2].rstrip('.'))),
+                'noise_dBm': _dbm(float(fields[3].rstrip('.'))),
+            }
+        return stats
+
+    def bitrate(self, interface):
+        # Only some drivers fill in speed for Wi-Fi links; the rest return EINVAL or -1
+        try:
+            with open(os.path.join(self.net_path, interface, 'speed')) as handle:
+                speed = int(handle.read().strip())
+        except (OSError, ValueError):
+            return None
+        return speed if speed > 0 else None
+
+    def sample(self, interface=None):
+        interface = interface or self.wireless_interface()
+        if interface is None:
+            return None
+        stats = self.read_wireless().get(interface)
+        if stats is None:
+            return None
+        return dict(stats, time=time.time(), interface=interface, bitrate_Mbps=self.bitrate(interface))
+
+
+def _dbm(value):
+    if value == CONST_NOISE_UNSET:
+        return None
+    # Wireless extensions report dBm as an unsigned byte on some drivers
+    return int(value - 256 if value > 63 else value)
+
+
+class WifiSampler:
+    def __init__(self, telemetry, interface=None, interval=CONST_SAMPLE_INTERVAL):
+        self.telemetry = telemetry
+        self.interface = interface
+        self.interval = interval
+        self.samples = []
+
+    def run(self, stop_event):
+        while True:
+            self.record()
+            if stop_event.wait(self.interval):
+                return
+
+    def record(self):
+        sample = self.telemetry.sample(self.interface)
+        if sample is not None:
+            self.samples.append(sample)
+
+    def stats(self):
+        signals = [sample['signal_dBm'] for sample in self.samples if sample['signal_dBm'] is not None]
+        return {
+            'samples': len(self.samples),
+            'signal_dBm': sum(signals) / len(signals) if signals else None,
+            'min_signal_dBm': min(signals, default=None),
+            'max_signal_dBm': max(signals, default=None),
+        }